@@ -1,7 +1,22 @@
-﻿from collections import defaultdict
-from typing import Dict
+﻿import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Dict, Tuple
 
-from openai import OpenAI
+import instrumentation
+from instrumentation import TOKENS_SENT, TOKENS_RECEIVED, traced, in_current_context
+
+from transport import TokenBucket
+
+AI_MODEL = "gpt-4o"
+# Chunks of comments are analyzed by at most this many concurrent requests
+AI_MAX_WORKERS = 4
+# Retries of failed requests (rate limits, server errors and connection errors), the client backs off between them
+AI_RETRIES = 5
+# Requests per second allowed on average and the burst allowed above it
+AI_RATE = 1.0
+AI_BURST = 4
 
 AI_STEPS_MESSAGE = """
     To proceed with the analysis, follow these steps:
@@ -38,9 +53,39 @@ AI_CONTENT_MESSAGE_CREATED_ISSUES_BY_TYPES = """
 AI_SYSTEM_MESSAGE = "You are an expert Quality Assurance Specialist at JetBrains with extensive knowledge of ReSharper's functionality, release cycles, and quality metrics. Your task is to analyze the data about the recent ReSharper releases to make a conclusions about quality."
 
 
+client = None
+client_lock = threading.Lock()
+rate_limiter = TokenBucket(AI_RATE, AI_BURST)
+
+
+# One client for all requests, it keeps its connections and can be used from several threads.
+# openai takes long to import, it's only loaded when the AI is asked for the first time.
+def get_client():
+    global client
+    with client_lock:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(max_retries=AI_RETRIES)
+        return client
+
+
+# Add tokens of the completion to the current instrumentation span.
+def record_usage(completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        instrumentation.add(**{TOKENS_SENT: usage.prompt_tokens, TOKENS_RECEIVED: usage.completion_tokens})
+
+
+# Ask the model within the rate limit and add the tokens to the current instrumentation span.
+def create_completion(messages: List[dict]):
+    rate_limiter.acquire()
+    completion = get_client().chat.completions.create(model=AI_MODEL, messages=messages)
+    record_usage(completion)
+    return completion
+
+
+@traced("openai")
 def ask_ai_issues_by_types(created: Dict[str, Dict[str, int]], fixed: Dict[str, Dict[str, int]]) -> str:
-    #global client
-    client = OpenAI()
     # Assemble the prompt manually
     prompt = ""
     ai_messages = [
@@ -70,18 +115,14 @@ def ask_ai_issues_by_types(created: Dict[str, Dict[str, int]], fixed: Dict[str,
     # Print the assembled prompt
     print(prompt)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=ai_messages
-    )
+    completion = create_completion(ai_messages)
     ai_response = completion.choices[0].message.content
     print(ai_response)
 
     return ai_response
 
+@traced("openai")
 def ask_ai_issues_by_priorities_2_weeks(data: Dict[str, Dict[str, int]]) -> str:
-    #global client
-    client = OpenAI()
     # Assemble the prompt manually
     prompt = ""
     ai_messages = [
@@ -107,18 +148,14 @@ def ask_ai_issues_by_priorities_2_weeks(data: Dict[str, Dict[str, int]]) -> str:
     # Print the assembled prompt
     print(prompt)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=ai_messages
-    )
+    completion = create_completion(ai_messages)
     ai_response = completion.choices[0].message.content
     print(ai_response)
 
     return ai_response
 
+@traced("openai")
 def ask_ai_issues_between_bugfixes(data: Dict[str, Dict[str, int]]) -> str:
-    #global client
-    client = OpenAI()
     # Assemble the prompt manually
     prompt = ""
     ai_messages = [
@@ -144,18 +181,14 @@ def ask_ai_issues_between_bugfixes(data: Dict[str, Dict[str, int]]) -> str:
     # Print the assembled prompt
     print(prompt)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=ai_messages
-    )
+    completion = create_completion(ai_messages)
     ai_response = completion.choices[0].message.content
     print(ai_response)
 
     return ai_response
 
+@traced("openai")
 def ask_ai_about_comments(data: Dict[str,list]):
-    #global client
-    client = OpenAI()
     # Assemble the prompt manually
     prompt = ""
     ai_messages = [
@@ -176,18 +209,14 @@ def ask_ai_about_comments(data: Dict[str,list]):
     # Print the assembled prompt
     print(prompt)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=ai_messages
-    )
+    completion = create_completion(ai_messages)
     ai_response = completion.choices[0].message.content
     print(ai_response)
 
     return ai_response
 
+@traced("openai")
 def ask_ai_about_comments_combine(data: list):
-    #global client
-    client = OpenAI()
     # Assemble the prompt manually
     prompt = ""
     ai_messages = [
@@ -204,11 +233,24 @@ def ask_ai_about_comments_combine(data: list):
     # Print the assembled prompt
     print(prompt)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=ai_messages
-    )
+    completion = create_completion(ai_messages)
     ai_response = completion.choices[0].message.content
     print(ai_response)
 
-    return ai_response
\ No newline at end of file
+    return ai_response
+
+
+# Map-reduce over chunks of comments: chunks are analyzed concurrently, then their answers are combined.
+# Answers are returned in the order of the chunks together with the combined one.
+@traced("openai")
+def ask_ai_about_comments_in_chunks(chunks: List[Dict[str, list]], max_workers: int = AI_MAX_WORKERS) -> Tuple[List[str], str]:
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        ai_responses = list(executor.map(in_current_context(ask_ai_about_comments), chunks))
+    return ai_responses, ask_ai_about_comments_combine(ai_responses)
+
+
+def split_dict(input_dict, n):
+    """Helper function to split dictionary into chunks of n items."""
+    iterator = iter(input_dict)
+    for _ in range(0, len(input_dict), n):
+        yield {k: input_dict[k] for k in islice(iterator, n)}
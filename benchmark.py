@@ -0,0 +1,235 @@
+﻿import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Dict, Callable, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+import markdown_writer
+import plotter
+import youtrack
+import youtrack_standin
+from ai_analysis import split_dict
+from issue_table import IssueTable
+from youtrack import GetIssues, YouTrackIssue, PRIORITY, SUBSYSTEM, TYPE, BUG_PRIORITY, PAGE_SIZE, count_issues
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+REPEAT = 3
+SEED = 0
+RESULTS_DIR = os.path.join("reports", "benchmarks")
+
+# Median slowdown of a stage compared to the baseline which counts as a regression.
+REGRESSION_THRESHOLD = 0.2
+
+# Synthetic issues are spread over these releases by their creation date.
+RELEASES = ["2023.1", "2023.2", "2023.3", "2024.1", "2024.2"]
+QUERY = "project: ReSharper"
+AI_SPLITS = 4
+
+
+# Synthetic corpus kept as encoded YouTrack pages, so fetching doesn't include generating the issues.
+# Comments are kept apart, like the comment texts which main.py splits into chunks for AI analysis.
+class Corpus:
+    def __init__(self, size: int, seed: int = SEED, page_size: int = PAGE_SIZE):
+        self.size = size
+        self.page_size = page_size
+        self.pages: List[bytes] = []
+        self.comments: Dict[str, List[str]] = {}
+
+        page = []
+        for issue_data in youtrack_standin.iter_generated_issues(size, seed):
+            comments = issue_data.pop("comments")
+            if comments:
+                self.comments[issue_data["idReadable"]] = [comment["text"] for comment in comments]
+            page.append(issue_data)
+            if len(page) == page_size:
+                self.pages.append(json.dumps(page).encode("utf-8"))
+                page = []
+        self.pages.append(json.dumps(page).encode("utf-8"))
+
+    @property
+    def bytes(self) -> int:
+        return sum(len(page) for page in self.pages)
+
+
+# Session which answers /issues requests from the corpus in memory, so only the client side is measured.
+class CorpusSession(requests.Session):
+    def __init__(self, corpus: Corpus):
+        super().__init__()
+        self.corpus = corpus
+
+    def request(self, method, url, *args, **kwargs):
+        params = parse_qs(urlsplit(url).query)
+        skip = int(params.get("$skip", ["0"])[0])
+        index = skip // self.corpus.page_size
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = "utf-8"
+        response._content = self.corpus.pages[index] if index < len(self.corpus.pages) else b"[]"
+        # The content is already in memory, iter_content() slices it instead of reading a socket
+        response._content_consumed = True
+        return response
+
+
+# Run the stage `repeat` times and return its timings and the result of the last run.
+def measure(stage: str, size: int, function: Callable[[], object], repeat: int) -> Tuple[dict, object]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    record = {
+        "stage": stage,
+        "size": size,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+    }
+    print(f"{size:>9} {stage:<45} {record['median']:10.4f}s")
+    return record, result
+
+
+def release_of(issue: YouTrackIssue) -> str:
+    start = youtrack_standin.to_millis(youtrack_standin.SYNTHETIC_START)
+    span = youtrack_standin.SYNTHETIC_DAYS * 24 * 3600 * 1000
+    index = (issue.created - start) * len(RELEASES) // span
+    return RELEASES[min(max(index, 0), len(RELEASES) - 1)]
+
+
+def group_by_release(issues: List[YouTrackIssue]) -> Dict[str, List[YouTrackIssue]]:
+    by_release = {release: [] for release in RELEASES}
+    for issue in issues:
+        by_release[release_of(issue)].append(issue)
+    return by_release
+
+
+def write_table(issues: List[YouTrackIssue], path: str):
+    markdown_writer.MARKDOWN_FILE = path
+    with open(path, "w", encoding="utf-8"):
+        pass
+    headers = ["Issue", "Type", "Priority", "Subsystem", "Summary"]
+    rows = [[issue.id, issue.type or "", issue.priority or "", issue.subsystem or "", issue.summary] for issue in issues]
+    markdown_writer.write_table(headers, rows)
+
+
+# Time all stages of the report pipeline on a corpus of the given size.
+def run_size(size: int, repeat: int, output_dir: str) -> List[dict]:
+    print(f"Generating {size} synthetic issues")
+    corpus = Corpus(size)
+    client = CorpusSession(corpus)
+    results = []
+
+    def stage(name: str, function: Callable[[], object]):
+        record, result = measure(name, size, function, repeat)
+        results.append(record)
+        return result
+
+    issues = stage("get_issues.parse", lambda: GetIssues(client, QUERY).get_issues())
+    results[-1]["bytes"] = corpus.bytes
+    stage("get_issues.parse_stream", lambda: list(GetIssues(client, QUERY, stream=True).iter_issues()))
+    stage("get_issues.aggregate", lambda: count_issues(issues, PRIORITY, SUBSYSTEM, TYPE, BUG_PRIORITY))
+
+    by_release = group_by_release(issues)
+    counts = stage("get_issues.aggregate_by_release",
+                   lambda: {release: count_issues(release_issues, PRIORITY, SUBSYSTEM, TYPE)
+                            for release, release_issues in by_release.items()})
+    releases, subsystems, by_subsystem_matrix = stage("issue_table.pivot", lambda: IssueTable.from_issues(by_release).pivot(SUBSYSTEM))
+
+    stage("split_dict", lambda: list(split_dict(corpus.comments, len(corpus.comments) // AI_SPLITS or 1)))
+    stage("markdown_writer.write_table", lambda: write_table(issues, os.path.join(output_dir, "report.md")))
+
+    by_priority = {release: release_counts[PRIORITY] for release, release_counts in counts.items()}
+    by_subsystem = {release: release_counts[SUBSYSTEM] for release, release_counts in counts.items()}
+    by_type = {release: release_counts[TYPE] for release, release_counts in counts.items()}
+    fixed_by_type = {release: count_issues([issue for issue in release_issues if issue.resolved], TYPE)[TYPE]
+                     for release, release_issues in by_release.items()}
+
+    plotter.IMAGES_DIR = output_dir
+    stage("plotter.plot_issues_by_type",
+          lambda: plotter.plot_issues_by_type(by_type[RELEASES[-1]], RELEASES[-1]))
+    stage("plotter.plot_multiple_priority_dicts",
+          lambda: plotter.plot_multiple_priority_dicts(by_priority, "Benchmark priorities", PRIORITY))
+    stage("plotter.plot_by_subsystems_several_releases",
+          lambda: plotter.plot_by_subsystems_several_releases(by_subsystem, "Benchmark subsystems", SUBSYSTEM))
+    stage("plotter.plot_heatmap",
+          lambda: plotter.plot_heatmap(releases, subsystems, by_subsystem_matrix, "Benchmark subsystems heatmap", SUBSYSTEM))
+    stage("plotter.plot_created_vs_fixed_by_category",
+          lambda: plotter.plot_created_vs_fixed_by_category(youtrack.TYPES, by_type, fixed_by_type, "Benchmark created vs fixed"))
+
+    return results
+
+
+def current_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+# Stages whose median time grew by more than the threshold compared to the baseline run.
+def find_regressions(results: List[dict], baseline: List[dict], threshold: float) -> List[str]:
+    baseline_medians = {(record["stage"], record["size"]): record["median"] for record in baseline}
+    regressions = []
+    for record in results:
+        previous = baseline_medians.get((record["stage"], record["size"]))
+        if previous and record["median"] > previous * (1 + threshold):
+            regressions.append(f"{record['stage']} ({record['size']} issues): "
+                               f"{previous:.4f}s -> {record['median']:.4f}s")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline on synthetic YouTrack issues.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of synthetic issues")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs of every stage, the median is compared")
+    parser.add_argument("--output", help="JSON file for the results (default: reports/benchmarks/<time>.json)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed slowdown of a stage compared to the baseline")
+    args = parser.parse_args(argv)
+
+    started = datetime.now()
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in args.sizes:
+            results.extend(run_size(size, args.repeat, output_dir))
+
+    report = {
+        "commit": current_commit(),
+        "started": started.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{started:%Y%m%d-%H%M%S}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results are saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = find_regressions(results, json.load(file)["results"], args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+﻿import functools
+import hashlib
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import instrumentation
+
+# Chart settings, plotter.py uses the same defaults
+IMAGES_DIR = os.path.join("reports", "images")
+IMAGE_FORMAT = "png"
+DPI = 100
+
+PLOTTER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plotter.py")
+
+
+# matplotlib takes long to import, so charts are drawn by plotter.py which is only loaded
+# by the process that draws the first chart.
+# Returns the image path, the seconds spent drawing and the peak RSS of the drawing process,
+# spans recorded in worker processes never reach the tracer of the report.
+def render_chart(kind: str, args: tuple, images_dir: str, image_format: str, dpi: int) -> Tuple[str, float, int]:
+    start = time.perf_counter()
+    import plotter
+    path = plotter.render_chart(kind, args, images_dir, image_format, dpi)
+    return path, time.perf_counter() - start, instrumentation.peak_rss()
+
+
+# Hash of the plotter code and the matplotlib version, a change of either changes every chart.
+@functools.lru_cache(maxsize=None)
+def plotter_code_hash() -> str:
+    with open(PLOTTER_FILE, "rb") as source:
+        return hashlib.sha256(source.read() + importlib.metadata.version("matplotlib").encode()).hexdigest()
+
+
+# Key of every chart is a hash of the plotter code, the chart kind, its data (with the title) and the output settings.
+CHART_CACHE_FILE = "chart_cache.json"
+
+
+def encode_chart_data(value):
+    # Chart data can only hold NumPy values if NumPy is loaded
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray):
+        return {"dtype": str(value.dtype), "shape": value.shape, "values": value.tolist()}
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't hash chart data of type {type(value).__name__}")
+
+
+# Images of charts already drawn with the same key are reused instead of being drawn again.
+class ChartCache:
+    def __init__(self, images_dir: str = None):
+        self.path = os.path.join(images_dir or IMAGES_DIR, CHART_CACHE_FILE)
+        self.lock = threading.Lock()
+        self.code_hash = plotter_code_hash()
+        # Image path -> key of the chart which is currently saved there
+        self.keys: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                self.keys = json.load(file)
+
+    # Dicts keep their order in the hash, the order of releases and categories changes the chart.
+    def key(self, kind: str, args: tuple, image_format: str, dpi: int) -> str:
+        data = json.dumps([self.code_hash, kind, args, image_format, dpi], default=encode_chart_data)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str:
+        with self.lock:
+            paths = [path for path, path_key in self.keys.items() if path_key == key]
+        for path in paths:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, key: str, path: str):
+        with self.lock:
+            self.keys[path] = key
+            directory = os.path.dirname(self.path) or "."
+            handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                json.dump(self.keys, file, indent=1)
+            os.replace(temp_path, self.path)
+
+
+# Renders charts in a pool of processes, so large charts are drawn on separate cores.
+# submit() returns a future of the image path. With processes=0 charts are drawn right away in this process.
+# With the cache enabled, charts whose code, data and settings haven't changed aren't drawn again.
+class ChartRenderer:
+    def __init__(self, processes: int = None, image_format: str = None, dpi: int = None, images_dir: str = None,
+                 cache: bool = True):
+        self.image_format = image_format or IMAGE_FORMAT
+        self.dpi = dpi or DPI
+        self.images_dir = images_dir or IMAGES_DIR
+        self.cache = ChartCache(self.images_dir) if cache else None
+        # Forking a process with running threads isn't safe, workers are started from scratch
+        self.executor = None if processes == 0 else ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, kind: str, *args) -> Future:
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(kind, args, self.image_format, self.dpi)
+            path = self.cache.get(key)
+            if path is not None:
+                future = Future()
+                future.set_result(path)
+                return future
+
+        # The span lasts from submitting the chart until it's drawn, so it includes the time spent in the queue
+        span = instrumentation.tracer.start("render_chart", "plot", kind=kind)
+        if self.executor is not None:
+            drawn = self.executor.submit(render_chart, kind, args, self.images_dir, self.image_format, self.dpi)
+        else:
+            drawn = Future()
+            try:
+                drawn.set_result(render_chart(kind, args, self.images_dir, self.image_format, self.dpi))
+            except Exception as error:
+                drawn.set_exception(error)
+
+        future = Future()
+        if key is not None:
+            future.add_done_callback(functools.partial(self.remember, key))
+        drawn.add_done_callback(functools.partial(self.finish, span, future))
+        return future
+
+    def finish(self, span: instrumentation.Span, future: Future, drawn: Future):
+        error = drawn.exception()
+        if error is not None:
+            span.attributes["error"] = type(error).__name__
+            instrumentation.tracer.finish(span)
+            future.set_exception(error)
+            return
+        path, seconds, peak_rss = drawn.result()
+        span.attributes["draw_seconds"] = round(seconds, 3)
+        if peak_rss is not None:
+            span.attributes["worker_peak_rss"] = peak_rss
+        instrumentation.tracer.finish(span)
+        future.set_result(path)
+
+    def remember(self, key: str, future: Future):
+        if future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self) -> "ChartRenderer":
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -0,0 +1,18 @@
+﻿import pytest
+
+import youtrack
+import youtrack_standin
+
+SYNTHETIC_ISSUES = 1000
+
+
+# Client of a stand-in YouTrack server with synthetic issues, shared by all tests.
+@pytest.fixture(scope="session")
+def client():
+    url = youtrack.YOUTRACK_URL
+    with youtrack_standin.synthetic_server(SYNTHETIC_ISSUES) as stand_in:
+        youtrack.YOUTRACK_URL = stand_in.url
+        try:
+            yield youtrack.create_session()
+        finally:
+            youtrack.YOUTRACK_URL = url
@@ -0,0 +1,204 @@
+﻿import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Iterator, Iterable, Optional, Tuple, TypeVar
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is not recorded there
+    resource = None
+
+TRACE_FILE = os.path.join("reports", "trace.json")
+
+# Counters which spans can accumulate.
+BYTES_RECEIVED = "bytes_received"
+ISSUES_PARSED = "issues_parsed"
+TOKENS_SENT = "tokens_sent"
+TOKENS_RECEIVED = "tokens_received"
+COUNTERS = [BYTES_RECEIVED, ISSUES_PARSED, TOKENS_SENT, TOKENS_RECEIVED]
+
+T = TypeVar("T")
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+# Peak resident set size of the process in bytes, or None if it can't be measured.
+def peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    def __init__(self, name: str, category: str, parent: "Span" = None, **attributes):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.attributes = attributes
+        self.counters = {counter: 0 for counter in COUNTERS}
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.peak_rss = None
+        self.lock = threading.Lock()
+
+    def add(self, **counters: int):
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        self.peak_rss = peak_rss()
+
+
+# Collects finished spans of a report run.
+class Tracer:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+    def start(self, name: str, category: str = "function", **attributes) -> Span:
+        return Span(name, category, current_span.get(), **attributes)
+
+    def finish(self, span: Span):
+        span.finish()
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, category: str = "function", **attributes) -> Iterator[Span]:
+        span = self.start(name, category, **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            current_span.reset(token)
+            self.finish(span)
+
+    # Span over the whole iteration. The span is current only while the next item is produced,
+    # so the consumer's code between items isn't attributed to it (except for its duration).
+    def iterate(self, items: Iterable[T], name: str, category: str = "function", counter: str = None,
+                **attributes) -> Iterator[T]:
+        span = self.start(name, category, **attributes)
+        iterator = iter(items)
+        try:
+            while True:
+                token = current_span.set(span)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    current_span.reset(token)
+                if counter:
+                    span.add(**{counter: 1})
+                yield item
+        finally:
+            self.finish(span)
+
+    # Trace in the Chrome trace event format, it can be opened in chrome://tracing or Perfetto.
+    def trace(self) -> dict:
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            args = dict(span.attributes)
+            args.update({name: value for name, value in span.counters.items() if value})
+            if span.peak_rss is not None:
+                args["peak_rss"] = span.peak_rss
+            if span.parent is not None:
+                args["parent"] = span.parent.name
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round((span.start - self.origin) * 1e6),
+                "dur": round(span.duration * 1e6),
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: str = TRACE_FILE) -> str:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.trace(), file)
+        return path
+
+    # Totals per span name: calls, seconds, counters and the highest peak RSS.
+    def summary(self) -> Dict[str, dict]:
+        with self.lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            total = totals.setdefault(span.name, {"category": span.category, "calls": 0, "seconds": 0.0,
+                                                  "peak_rss": None, **{counter: 0 for counter in COUNTERS}})
+            total["calls"] += 1
+            total["seconds"] += span.duration
+            for name, value in span.counters.items():
+                total[name] = total.get(name, 0) + value
+            if span.peak_rss is not None:
+                total["peak_rss"] = max(total["peak_rss"] or 0, span.peak_rss)
+        return totals
+
+    def summary_table(self) -> Tuple[List[str], List[List[str]]]:
+        headers = ["Span", "Calls", "Seconds", "Bytes received", "Issues parsed", "Tokens sent", "Tokens received",
+                   "Peak RSS, MB"]
+        rows = []
+        for name, total in sorted(self.summary().items(), key=lambda item: item[1]["seconds"], reverse=True):
+            peak = "" if total["peak_rss"] is None else f"{total['peak_rss'] / 2 ** 20:.0f}"
+            rows.append([name, str(total["calls"]), f"{total['seconds']:.2f}", str(total[BYTES_RECEIVED]),
+                         str(total[ISSUES_PARSED]), str(total[TOKENS_SENT]), str(total[TOKENS_RECEIVED]), peak])
+        return headers, rows
+
+
+tracer = Tracer()
+
+
+def span(name: str, category: str = "function", **attributes):
+    return tracer.span(name, category, **attributes)
+
+
+def iterate(items: Iterable[T], name: str, category: str = "function", counter: str = None, **attributes) -> Iterator[T]:
+    return tracer.iterate(items, name, category, counter, **attributes)
+
+
+# Add counters to the innermost span of the current thread or task. Does nothing outside of spans.
+def add(**counters: int):
+    span = current_span.get()
+    if span is not None:
+        span.add(**counters)
+
+
+# Decorator which runs every call of the function in a span named after it.
+def traced(category: str = "function"):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(function.__name__, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Run a function in other threads (e.g. in an executor) inside the spans of the calling thread.
+def in_current_context(function):
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # A context can't be entered by several threads at once, so every call gets its own copy
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
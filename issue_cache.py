@@ -0,0 +1,194 @@
+﻿import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+from urllib.parse import unquote
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, Iterator, Iterable, Set
+
+CACHE_FILE = os.path.join("reports", "issue_cache.sqlite")
+
+# Entries of open windows are refreshed once they are older than this (seconds).
+DEFAULT_TTL = 60 * 60
+
+# A date window which ended more than this many days ago is treated as closed and never refreshed.
+IMMUTABLE_AFTER_DAYS = 30
+
+# Custom fields which still change on issues of closed windows (issues created in past releases are still fixed).
+# Closed windows which query or fetch them are refreshed after MUTABLE_TTL seconds instead of never.
+MUTABLE_FIELDS = ["State"]
+MUTABLE_TTL = 24 * 60 * 60
+
+# Seconds to wait for another thread which is writing to the database.
+SQLITE_TIMEOUT = 60
+
+DATE_RANGE = re.compile(r'(\d{4}-\d{2}-\d{2})\s*\.\.\s*(\d{4}-\d{2}-\d{2})')
+
+
+class CacheEntry:
+    def __init__(self, fetched_at: float, synced_at: float, ttl: Optional[float]):
+        self.fetched_at = fetched_at
+        self.synced_at = synced_at
+        # None means the entry never expires.
+        self.ttl = ttl
+
+    def is_fresh(self, now: float = None) -> bool:
+        if self.ttl is None:
+            return True
+        now = time.time() if now is None else now
+        return now - self.synced_at < self.ttl
+
+
+# Query is immutable if all its date windows ended long enough ago (e.g. past release cycles).
+def is_immutable(query: str, immutable_after_days: int = IMMUTABLE_AFTER_DAYS) -> bool:
+    ranges = DATE_RANGE.findall(query)
+    if not ranges:
+        return False
+    threshold = datetime.now() - timedelta(days=immutable_after_days)
+    return all(datetime.strptime(end, "%Y-%m-%d") < threshold for _, end in ranges)
+
+
+def has_mutable_fields(query: str, fields: str = "") -> bool:
+    text = f"{query} {unquote(fields)}"
+    return any(re.search(rf"\b{re.escape(name)}\b", text, re.IGNORECASE) for name in MUTABLE_FIELDS)
+
+
+# Seconds after which issues of the query (with the requested fields) are fetched again, None if they never change.
+def refresh_period(query: str, fields: str = "", ttl: float = DEFAULT_TTL,
+                   immutable_after_days: int = IMMUTABLE_AFTER_DAYS) -> Optional[float]:
+    if not is_immutable(query, immutable_after_days):
+        return ttl
+    return MUTABLE_TTL if has_mutable_fields(query, fields) else None
+
+
+# Local cache of raw YouTrack issues keyed by the normalized query and the requested fields.
+# Issues are stored one per row, so they can be written and read back without holding the whole result in memory.
+class IssueCache:
+    def __init__(self, path: str = CACHE_FILE, ttl: float = DEFAULT_TTL, immutable_after_days: int = IMMUTABLE_AFTER_DAYS):
+        self.path = path
+        self.ttl = ttl
+        self.immutable_after_days = immutable_after_days
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self.connect() as connection:
+            # Several queries are cached concurrently, WAL lets them read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS query_entries (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    synced_at REAL NOT NULL,
+                    ttl REAL
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS query_issues (
+                    key TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (key, id)
+                )""")
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+        # Issues are committed one by one, with WAL this doesn't wait for the disk on every commit.
+        # A crash can only lose the last commits, and the entry of a query is written after its issues.
+        connection.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return " ".join(query.split())
+
+    def key(self, query: str, fields: str) -> str:
+        normalized = f"{self.normalize_query(query)}|{fields}"
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def ttl_for(self, query: str, fields: str) -> Optional[float]:
+        return refresh_period(query, fields, self.ttl, self.immutable_after_days)
+
+    # Get the entry of a completely stored query, or None.
+    # The TTL follows the current settings, not the ones the entry was written with.
+    def get(self, query: str, fields: str) -> Optional[CacheEntry]:
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT fetched_at, synced_at FROM query_entries WHERE key = ?",
+                (self.key(query, fields),)).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(*row, self.ttl_for(query, fields))
+
+    # Stream cached issues of the query.
+    def iter_issues(self, query: str, fields: str) -> Iterator[dict]:
+        with self.connect() as connection:
+            for data, in connection.execute("SELECT data FROM query_issues WHERE key = ? ORDER BY rowid",
+                                            (self.key(query, fields),)):
+                yield json.loads(zlib.decompress(data))
+
+    def write_entry(self, query: str, fields: str, fetched_at: float) -> CacheEntry:
+        entry = CacheEntry(fetched_at, time.time(), self.ttl_for(query, fields))
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO query_entries (key, query, fields, fetched_at, synced_at, ttl) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(query, fields), self.normalize_query(query), fields, entry.fetched_at, entry.synced_at, entry.ttl))
+        return entry
+
+    # Write issues one by one while passing them through, so only the current issue is held in memory.
+    # Every issue is committed before it is passed on, an open transaction would keep other queries
+    # from writing while the caller handles the issue or the next page is downloaded.
+    def write_issues(self, key: str, issues: Iterable[dict]) -> Iterator[dict]:
+        with self.connect() as connection:
+            for issue in issues:
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO query_issues (key, id, data) VALUES (?, ?, ?)",
+                                       (key, issue['idReadable'], zlib.compress(json.dumps(issue).encode('utf-8'))))
+                yield issue
+
+    # Store all issues of the query while passing them through to the caller.
+    # The entry is written after the last issue, so an interrupted download is never treated as cached.
+    def store(self, query: str, fields: str, issues: Iterable[dict]) -> Iterator[dict]:
+        key = self.key(query, fields)
+        fetched_at = time.time()
+        with self.connect() as connection:
+            connection.execute("DELETE FROM query_entries WHERE key = ?", (key,))
+            connection.execute("DELETE FROM query_issues WHERE key = ?", (key,))
+
+        yield from self.write_issues(key, issues)
+        self.write_entry(query, fields, fetched_at)
+
+    # Replace cached issues by their updated versions, drop issues which don't match the query any more
+    # (`ids` are all issues matching it now) and mark the entry as synced.
+    def update(self, query: str, fields: str, entry: CacheEntry, updated: Iterable[dict], ids: Set[str]) -> CacheEntry:
+        key = self.key(query, fields)
+        for _ in self.write_issues(key, updated):
+            pass
+        with self.connect() as connection:
+            cached = [issue_id for issue_id, in connection.execute("SELECT id FROM query_issues WHERE key = ?", (key,))]
+            connection.executemany("DELETE FROM query_issues WHERE key = ? AND id = ?",
+                                   [(key, issue_id) for issue_id in cached if issue_id not in ids])
+        return self.write_entry(query, fields, entry.fetched_at)
+
+    # Query which asks only for issues updated since the last sync of the entry.
+    # YouTrack date search is day-based, so the day of the last sync is included again.
+    @staticmethod
+    def refresh_query(query: str, entry: CacheEntry) -> str:
+        since = datetime.fromtimestamp(entry.synced_at).strftime("%Y-%m-%d")
+        return f"({query}) and updated: {since} .. Today"
+
+    def clear(self):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM query_entries")
+            connection.execute("DELETE FROM query_issues")
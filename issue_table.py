@@ -0,0 +1,140 @@
+﻿from typing import List, Dict, Tuple
+
+import numpy as np
+
+import youtrack
+from youtrack import YouTrackIssue
+
+RELEASE = "Release"
+
+# Code of a missing value in a column.
+MISSING = -1
+
+# Column which sums up the categories left out of a chart.
+OTHER = "Other"
+
+# Ways to rank categories: by issues in all releases, or by the change between the first and the last release.
+RANK_BY = ["total", "delta"]
+
+# Column name -> YouTrackIssue attribute. The release column is filled from the labels of the issue lists.
+COLUMNS = {
+    RELEASE: None,
+    youtrack.PRIORITY: "priority",
+    youtrack.TYPE: "type",
+    youtrack.SUBSYSTEM: "subsystem",
+    youtrack.STATE: "state",
+}
+
+
+# Values of one categorical column.
+class Categories:
+    def __init__(self):
+        self.labels: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        if value is None:
+            return MISSING
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.labels)
+            self.index[value] = code
+            self.labels.append(value)
+        return code
+
+    def codes_of(self, values: List[str]) -> List[int]:
+        return [self.index[value] for value in values if value in self.index]
+
+
+# Issues of several releases stored column by column as arrays of categorical codes.
+# Group-bys, pivots and ratios are NumPy operations over these arrays.
+class IssueTable:
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, Categories]):
+        self.columns = columns
+        self.categories = categories
+
+    @classmethod
+    def from_issues(cls, issues_by_release: Dict[str, List[YouTrackIssue]]) -> "IssueTable":
+        categories = {name: Categories() for name in COLUMNS}
+        codes = {name: [] for name in COLUMNS}
+
+        for release, issues in issues_by_release.items():
+            release_code = categories[RELEASE].encode(release)
+            codes[RELEASE].extend([release_code] * len(issues))
+            for name, attribute in COLUMNS.items():
+                if attribute is None:
+                    continue
+                encode = categories[name].encode
+                codes[name].extend([encode(getattr(issue, attribute)) for issue in issues])
+
+        columns = {name: np.array(values, dtype=np.int32) for name, values in codes.items()}
+        return cls(columns, categories)
+
+    def __len__(self) -> int:
+        return len(self.columns[RELEASE])
+
+    def labels(self, column: str) -> List[str]:
+        return self.categories[column].labels
+
+    # Rows whose value in the column is one of the values.
+    def where(self, column: str, values: List[str]) -> np.ndarray:
+        return np.isin(self.columns[column], self.categories[column].codes_of(values))
+
+    def bugs(self) -> np.ndarray:
+        return self.where(youtrack.TYPE, youtrack.BUG_TYPES)
+
+    # Matrix of counts with one row per release and one column per category.
+    # If categories are given, the matrix columns follow them (unknown categories are counted as zeros).
+    def pivot(self, column: str, where: np.ndarray = None, categories: List[str] = None) -> Tuple[List[str], List[str], np.ndarray]:
+        releases = self.labels(RELEASE)
+        labels = self.labels(column)
+        codes = self.columns[column]
+
+        valid = codes != MISSING
+        if where is not None:
+            valid &= where
+        flat = self.columns[RELEASE][valid] * len(labels) + codes[valid]
+        matrix = np.bincount(flat, minlength=len(releases) * len(labels)).reshape(len(releases), len(labels))
+
+        if categories is None:
+            return releases, labels, matrix
+
+        index = self.categories[column].index
+        ordered = np.zeros((len(releases), len(categories)), dtype=matrix.dtype)
+        for i, category in enumerate(categories):
+            if category in index:
+                ordered[:, i] = matrix[:, index[category]]
+        return releases, list(categories), ordered
+
+
+# Matrix of {category: count} dicts (e.g. counted by YouTrack) with one row per dict and one column per category.
+def counts_matrix(counts: List[Dict[str, int]], categories: List[str]) -> np.ndarray:
+    matrix = np.array([[row.get(category, 0) for category in categories] for row in counts], dtype=np.int64)
+    return matrix.reshape(len(counts), len(categories))
+
+
+# Keep the `top` categories with the highest rank (columns of a pivot matrix) and sum the rest into one "Other" column.
+# Kept categories are ordered by their rank.
+def top_categories(categories: List[str], matrix: np.ndarray, top: int = None, rank_by: str = "total") -> Tuple[List[str], np.ndarray]:
+    if rank_by not in RANK_BY:
+        raise ValueError(f"Unknown ranking of categories: {rank_by}, expected one of {RANK_BY}")
+    if top is None or len(categories) <= top:
+        return list(categories), matrix
+
+    if rank_by == "total":
+        rank = matrix.sum(axis=0)
+    else:
+        rank = np.abs(matrix[-1] - matrix[0])
+    kept = np.argsort(-rank, kind="stable")[:top]
+    rest = np.ones(len(categories), dtype=bool)
+    rest[kept] = False
+    rolled_up = np.column_stack([matrix[:, kept], matrix[:, rest].sum(axis=1)])
+    return [categories[i] for i in kept] + [OTHER], rolled_up
+
+
+# Split the columns of a pivot matrix into pages of at most `page_size` categories.
+def pages(categories: List[str], matrix: np.ndarray, page_size: int = None) -> List[Tuple[List[str], np.ndarray]]:
+    if not page_size or len(categories) <= page_size:
+        return [(list(categories), matrix)]
+    return [(list(categories[start:start + page_size]), matrix[:, start:start + page_size])
+            for start in range(0, len(categories), page_size)]
@@ -1,30 +1,128 @@
-﻿import os
+﻿import contextvars
+import os
+import re
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Iterator, Iterable
 
 REPORTS_DIR = "reports"
 IMAGES_DIR = os.path.join(REPORTS_DIR, "images")
 MARKDOWN_FILE = os.path.join(REPORTS_DIR, "ReSharper_Quality_Report.md")
 
-def initialize_markdown():
-    with open(MARKDOWN_FILE, 'w', encoding='utf-8') as md_file:
-        md_file.write("# ReSharper Release Quality Analysis Report\n\n")
-        md_file.write(f"**Date:** {datetime.now().strftime('%Y-%m-%d')}\n\n")
-        md_file.write("## Table of Contents\n")
-        md_file.write("- [Issues Created By jetbrains-team vs Fixed](#issues-created-by-jetbrains-team-vs-fixed)\n")
-        md_file.write("- [Issues created by users 2 weeks after the release](#issues-created-by-users-2-weeks-after-the-release)\n")
-        md_file.write("- [Issues created by users in 242 release between bugfixes](#issues-created-by-users-in-242-release-between-bugfixes)\n\n")
+# Part of the report written by one section. Sections run concurrently, so they write into fragments
+# which are put into the report in a fixed order when all of them are done.
+class Fragment:
+    def __init__(self):
+        self.parts: List[str] = []
 
+    def append(self, content: str):
+        self.parts.append(content + "\n\n")
+
+    # Fragment of an earlier run, saved as text.
+    @classmethod
+    def from_text(cls, text: str) -> "Fragment":
+        saved = cls()
+        saved.parts.append(text)
+        return saved
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    # Second level headings, they make up the table of contents.
+    def headings(self) -> List[str]:
+        return [line[3:].strip() for line in self.text().splitlines() if line.startswith("## ")]
+
+
+# Streams blocks through one open handle of a temporary file next to the target.
+# The file replaces the target only when writing succeeded, so a failed run never leaves half a report.
+class DocumentWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.temp_path = None
+        self.file = None
+        self.token = None
+
+    def append(self, content: str):
+        self.file.write(content + "\n\n")
+
+    def write(self, text: str):
+        self.file.write(text)
+
+    def __enter__(self) -> "DocumentWriter":
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        handle, self.temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        self.file = os.fdopen(handle, 'w', encoding='utf-8')
+        self.token = current_output.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        current_output.reset(self.token)
+        self.file.close()
+        if exc_type is None:
+            # Temporary files are only readable by the owner, keep the mode of the report instead
+            mode = os.stat(self.path).st_mode & 0o777 if os.path.exists(self.path) else 0o644
+            os.chmod(self.temp_path, mode)
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
+
+
+# Fragment or document which append_markdown() and write_table() of this thread (or task) write into.
+current_output = contextvars.ContextVar("current_output", default=None)
+
+
+# Redirect append_markdown() and write_table() of this thread (or task) into a new fragment.
+@contextmanager
+def fragment() -> Iterator[Fragment]:
+    new_fragment = Fragment()
+    token = current_output.set(new_fragment)
+    try:
+        yield new_fragment
+    finally:
+        current_output.reset(token)
+
+
+# GitHub anchor of a heading: lower case, punctuation removed, spaces replaced with hyphens.
+def anchor(heading: str) -> str:
+    return re.sub(r"[^\w\- ]", "", heading.lower()).replace(" ", "-")
+
+
+def render_header(headings: List[str] = ()) -> str:
+    lines = ["# ReSharper Release Quality Analysis Report\n",
+             f"**Date:** {datetime.now().strftime('%Y-%m-%d')}\n",
+             "## Table of Contents"]
+    lines.extend(f"- [{heading}](#{anchor(heading)})" for heading in headings)
+    return "\n".join(lines) + "\n\n"
+
+def initialize_markdown(headings: List[str] = ()):
+    with DocumentWriter(MARKDOWN_FILE) as document:
+        document.write(render_header(headings))
+
+# Write the report from fragments in the given order with a table of contents of their headings.
+def write_report(fragments: List[Fragment], path: str = None):
+    with DocumentWriter(path or MARKDOWN_FILE) as document:
+        document.write(render_header([heading for report_fragment in fragments for heading in report_fragment.headings()]))
+        for report_fragment in fragments:
+            document.write(report_fragment.text())
+
+# Outside of fragments and documents every block is appended to the report file right away.
 def append_markdown(content: str):
+    current = current_output.get()
+    if current is not None:
+        current.append(content)
+        return
     with open(MARKDOWN_FILE, 'a', encoding='utf-8') as md_file:
         md_file.write(content + "\n\n")
 
-def write_table(headers: List[str], rows: List[List[str]]):
-    table = "| " + " | ".join(headers) + " |\n"
-    table += "| " + " | ".join(['---'] * len(headers)) + " |\n"
-    for row in rows:
-        table += "| " + " | ".join(row) + " |\n"
-    append_markdown(table)
+def render_table(headers: List[str], rows: Iterable[List[str]]) -> str:
+    lines = ["| " + " | ".join(headers) + " |", "| " + " | ".join(['---'] * len(headers)) + " |"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows)
+    return "\n".join(lines) + "\n"
+
+def write_table(headers: List[str], rows: Iterable[List[str]]):
+    append_markdown(render_table(headers, rows))
 
 def log_issues_by_type(data: Dict[str, Dict[str, int]]):
     append_markdown("## Issue Types Analysis\n")
@@ -1,23 +1,47 @@
-﻿import os
-from typing import Dict
-
+﻿import functools
+import os
+import threading
+from typing import Dict, List
+
+import matplotlib
+# Charts are only saved to files, so they are always drawn without a display
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 
 import youtrack
+from instrumentation import traced
+from issue_table import counts_matrix, top_categories
 
 IMAGES_DIR = os.path.join("reports", "images")
-PRIORITIES = ['Show-stopper', 'Critical', 'Major', 'Normal', 'Minor']
-TYPES = ['Bug', 'Performance Problem', 'Security Problem', 'Exception', 'Usability Problem', 'Cosmetics', 'Improvement', 'Task', 'Feature', 'Plan', ]
+IMAGE_FORMAT = "png"
+DPI = 100
+PRIORITIES = youtrack.PRIORITIES
+TYPES = youtrack.TYPES
+
+# Heatmaps with more cells are not annotated with counts, they wouldn't be readable.
+MAX_ANNOTATED_CELLS = 400
+
+# pyplot keeps the current figure in global state, so charts of concurrently running sections are drawn one at a time.
+PLOT_LOCK = threading.RLock()
 
+def locked(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with PLOT_LOCK:
+            return function(*args, **kwargs)
+    return wrapper
+
+@traced("plot")
 def save_plot(fig, title: str) -> str:
     # Generate a safe filename
-    filename = f"{title.replace(' ', '_').lower()}.png"
+    filename = f"{title.replace(' ', '_').lower()}.{IMAGE_FORMAT}"
     filepath = os.path.join(IMAGES_DIR, filename)
-    fig.savefig(filepath, bbox_inches='tight')
+    fig.savefig(filepath, bbox_inches='tight', format=IMAGE_FORMAT, dpi=DPI)
     plt.close(fig)  # Close the figure to free memory
     return filepath
 
+@locked
 def plot_issues_by_type(issue_type_counts: Dict[str, int], dates: str) -> str:
     # Sort issue types by count in descending order
     sorted_issue_types = sorted(issue_type_counts.items(), key=lambda x: x[1], reverse=True)
@@ -34,86 +58,94 @@ def plot_issues_by_type(issue_type_counts: Dict[str, int], dates: str) -> str:
     fig = plt.figure(figsize=(8, 8))
     plt.pie(sorted_counts, labels=sorted_labels, autopct=absolute_number, startangle=140)
     plt.title(f'Distribution of Issues by Type Created by JetBrains Team ({dates})')
-    plt.show()
 
     # Save the plot and return the image path
     image_path = save_plot(fig, f'Distribution of Issues by Type Created by JetBrains Team ({dates})')
     return image_path
 
-def plot_by_subsystems_several_releases(issues: Dict[str, Dict[str, int]], title: str, category: str) -> str:
-    # Setting up the bar width
-    bar_width = 0.2  # Adjust this to fit your needs
-    index = 0
+# Convert {label: {category: count}} to a matrix with one row per label and one column per category.
+def dicts_to_matrix(issues: Dict[str, Dict[str, int]], categories: List[str]) -> np.ndarray:
+    return counts_matrix(list(issues.values()), categories)
 
+def all_categories(issues: Dict[str, Dict[str, int]]) -> List[str]:
     all_subsystems = set()
     for subsystem_counts in issues.values():
         all_subsystems.update(subsystem_counts.keys())
-    subsystems = sorted(all_subsystems)
+    return sorted(all_subsystems)
 
-    index = np.arange(len(subsystems))
-    fig = plt.figure(figsize=(18, 8))
+# Grouped bars: one group per category, one bar per row of the matrix.
+@locked
+def plot_matrix(labels: List[str], categories: List[str], counts: np.ndarray, title: str, category: str) -> str:
+    # Setting up the bar width, groups of more than four releases get narrower bars
+    bar_width = min(0.2, 0.8 / max(1, len(labels)))
 
-    for i, (label, subsystem_counts) in enumerate(issues.items()):
-        counts = [subsystem_counts.get(subsystem, 0) for subsystem in subsystems]
-        plt.bar(index + i * bar_width, counts, bar_width, label=label)
+    index = np.arange(len(categories))
+    if category == youtrack.PRIORITY:
+        fig = plt.figure(figsize=(12, 6))
+    else:
+        fig = plt.figure(figsize=(18, 8))
 
+    for i, label in enumerate(labels):
+        plt.bar(index + i * bar_width, counts[i], bar_width, label=label)
 
     # Adding titles and labels
     plt.title(title)
     plt.xlabel(category)
     plt.ylabel('Number of Issues')
-    plt.xticks(index + bar_width * (len(issues) - 1) / 2, subsystems, rotation=90)
+    plt.xticks(index + bar_width * (len(labels) - 1) / 2, categories, rotation=45 if category == youtrack.PRIORITY else 90)
     plt.legend()
     plt.tight_layout()
 
-    plt.show()
-
     image_path = save_plot(fig, title)
     return image_path
 
-def plot_multiple_priority_dicts(issues: Dict[str, Dict[str, int]], title: str, category: str) -> str:
-    # Setting up the bar width
-    bar_width = 0.2  # Adjust this to fit your needs
-    index = 0
+# Heatmap with one row per category and one column per row of the matrix (release).
+# The image grows with the number of categories instead of squeezing them, so it suits hundreds of subsystems.
+@locked
+def plot_heatmap(labels: List[str], categories: List[str], counts: np.ndarray, title: str, category: str) -> str:
+    fig, ax = plt.subplots(figsize=(max(6, 1.2 * len(labels) + 4), max(4, 0.25 * len(categories) + 2)))
+    image = ax.imshow(counts.T, aspect='auto', cmap='Blues')
 
-    if category == youtrack.PRIORITY:
-        index = np.arange(len(PRIORITIES))
-        fig = plt.figure(figsize=(12, 6))
-    if category == youtrack.SUBSYSTEM:
-        all_subsystems = set()
-        for subsystem_counts in issues.values():
-            all_subsystems.update(subsystem_counts.keys())
-        subsystems = sorted(all_subsystems)
-        index = np.arange(len(subsystems))
-        fig = plt.figure(figsize=(18, 8))
+    ax.set_title(title)
+    ax.set_ylabel(category)
+    ax.set_xticks(np.arange(len(labels)))
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.set_yticks(np.arange(len(categories)))
+    ax.set_yticklabels(categories)
+    fig.colorbar(image, ax=ax, label='Number of Issues')
+
+    if counts.size <= MAX_ANNOTATED_CELLS:
+        threshold = counts.max() / 2 if counts.size else 0
+        for (row, column), value in np.ndenumerate(counts):
+            ax.text(row, column, str(value), ha='center', va='center', fontsize=8,
+                    color='white' if value > threshold else 'black')
+    fig.tight_layout()
 
+    image_path = save_plot(fig, title)
+    return image_path
 
-    if category == youtrack.PRIORITY:
-        for i, (label, priority_counts) in enumerate(issues.items()):
-            counts = [priority_counts.get(priority, 0) for priority in PRIORITIES]
-            plt.bar(index + i * bar_width, counts, bar_width, label=label)
-    if category == youtrack.SUBSYSTEM:
-        for i, (label, subsystem_counts) in enumerate(issues.items()):
-            counts = [subsystem_counts.get(subsystem, 0) for subsystem in subsystems]
-            plt.bar(index + i * bar_width, counts, bar_width, label=label)
+# Subsystems of several releases, optionally only the `top` of them with the rest summed up as "Other".
+def plot_by_subsystems_several_releases(issues: Dict[str, Dict[str, int]], title: str, category: str, top: int = None,
+                                        rank_by: str = "total") -> str:
+    subsystems = all_categories(issues)
+    subsystems, counts = top_categories(subsystems, dicts_to_matrix(issues, subsystems), top, rank_by)
+    return plot_matrix(list(issues.keys()), subsystems, counts, title, category)
 
-    # Adding titles and labels
-    plt.title(title)
-    plt.xlabel(category)
-    plt.ylabel('Number of Issues')
+def plot_multiple_priority_dicts(issues: Dict[str, Dict[str, int]], title: str, category: str) -> str:
     if category == youtrack.PRIORITY:
-        plt.xticks(index + bar_width * (len(issues) - 1) / 2, PRIORITIES, rotation=45)
-    if category == youtrack.SUBSYSTEM:
-        plt.xticks(index + bar_width * (len(issues) - 1) / 2, subsystems, rotation=90)
-    plt.legend()
-    plt.tight_layout()
-
-    plt.show()
-
-    image_path = save_plot(fig, title)
-    return image_path
+        categories = PRIORITIES
+    else:
+        categories = all_categories(issues)
+    return plot_matrix(list(issues.keys()), categories, dicts_to_matrix(issues, categories), title, category)
 
 def plot_created_vs_fixed_by_category(categories: list[str], data_created: Dict[str, Dict[str, int]], data_fixed: Dict[str, Dict[str, int]], title:str) -> str:
+    fixed = {key: data_fixed[key] for key in data_created.keys()}
+    return plot_created_vs_fixed_matrix(list(data_created.keys()), categories, dicts_to_matrix(data_created, categories),
+                                        dicts_to_matrix(fixed, categories), title)
+
+# Created vs fixed bars for matrices with one row per release and one column per category.
+@locked
+def plot_created_vs_fixed_matrix(labels: List[str], categories: List[str], created: np.ndarray, fixed: np.ndarray, title: str) -> str:
     # Pastel colors for bars
     pastel_colors = [
         '#AEC6CF', '#FFB347', '#77DD77', '#FF6961',  # Original colors
@@ -129,10 +161,10 @@ def plot_created_vs_fixed_by_category(categories: list[str], data_created: Dict[
     fixed_bars = []
 
     # Loop through data and plot both created and fixed bars
-    for i, (key, color) in enumerate(zip(data_created.keys(), pastel_colors)):
+    for i, (key, color) in enumerate(zip(labels, pastel_colors)):
         # Extracting the values
-        created_values = [data_created[key].get(priority, 0) for priority in categories]
-        fixed_values = [data_fixed[key].get(priority, 0) for priority in categories]
+        created_values = created[i]
+        fixed_values = fixed[i]
 
         # Plotting the created bars with less visibility
         ax.bar(x + (i - 2) * width, created_values, width, label=f'{key} - created', color=color, alpha=0.4)
@@ -169,13 +201,22 @@ def plot_created_vs_fixed_by_category(categories: list[str], data_created: Dict[
                         textcoords="offset points",
                         ha='center', va='bottom')
 
-    total_values = [sum(data_fixed[key].get(priority, 0) for key in data_fixed.keys()) for priority in categories]
-
     for rects in fixed_bars:
         add_labels(rects)
 
     fig.tight_layout()
-    plt.show()
 
     image_path = save_plot(fig, title)
-    return image_path
\ No newline at end of file
+    return image_path
+
+
+# Chart kind -> function. Jobs refer to charts by kind, so they can be sent to other processes.
+CHARTS = {function.__name__: function for function in [plot_issues_by_type, plot_matrix, plot_heatmap,
+                                                      plot_by_subsystems_several_releases, plot_multiple_priority_dicts,
+                                                      plot_created_vs_fixed_by_category, plot_created_vs_fixed_matrix]}
+
+# Draw one chart with the given output settings and return the image path.
+def render_chart(kind: str, args: tuple, images_dir: str, image_format: str, dpi: int) -> str:
+    global IMAGES_DIR, IMAGE_FORMAT, DPI
+    IMAGES_DIR, IMAGE_FORMAT, DPI = images_dir, image_format, dpi
+    return CHARTS[kind](*args)
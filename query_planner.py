@@ -0,0 +1,197 @@
+﻿from datetime import datetime
+from typing import List, Dict, Callable, Tuple, Union, TypeVar
+
+import requests
+
+from issue_cache import IssueCache
+from youtrack import GetIssues, CountIssues, YouTrackIssue, Projection, DEFAULT_PROJECTION, MAX_WORKERS, fetch_concurrently
+
+T = TypeVar("T")
+
+
+# Condition which can be sent to YouTrack as a part of a query or checked locally on a fetched issue.
+class Predicate:
+    def to_youtrack(self) -> str:
+        raise NotImplementedError
+
+    def matches(self, issue: YouTrackIssue) -> bool:
+        raise NotImplementedError
+
+    # Fields which must be fetched to check the predicate locally.
+    def projection(self) -> Projection:
+        return Projection(fields=[])
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_youtrack() == other.to_youtrack()
+
+    def __hash__(self):
+        return hash(self.to_youtrack())
+
+
+# "created: 2024-04-10 .. 2024-08-14", both days are included.
+# It is always sent to YouTrack, which evaluates dates in the timezone of the user's profile,
+# so it can't be checked on fetched issues.
+class CreatedIn(Predicate):
+    def __init__(self, dates: str):
+        start, end = [part.strip() for part in dates.split("..")]
+        self.start = datetime.strptime(start, "%Y-%m-%d")
+        self.end = datetime.strptime(end, "%Y-%m-%d")
+
+    @property
+    def dates(self) -> str:
+        return f"{self.start:%Y-%m-%d} .. {self.end:%Y-%m-%d}"
+
+    def to_youtrack(self) -> str:
+        return f"created: {self.dates}"
+
+
+# "(state: fixed or state: Verified)"
+class StateIn(Predicate):
+    def __init__(self, *states: str):
+        self.states = states
+        self.lower_states = {state.lower() for state in states}
+
+    def to_youtrack(self) -> str:
+        return "(" + " or ".join(f"state: {state}" for state in self.states) + ")"
+
+    def projection(self) -> Projection:
+        return Projection(["State"], fields=[])
+
+    def matches(self, issue: YouTrackIssue) -> bool:
+        return issue.state is not None and issue.state.lower() in self.lower_states
+
+
+# YouTrack query split into a base which is always sent to YouTrack and predicates (some of them can be checked locally).
+class Query:
+    def __init__(self, base: str, *predicates: Predicate):
+        self.base = base
+        self.predicates = predicates
+
+    def to_youtrack(self) -> str:
+        return " and ".join([self.base] + [predicate.to_youtrack() for predicate in self.predicates])
+
+    def windows(self) -> Tuple[str, ...]:
+        return tuple(predicate.to_youtrack() for predicate in self.predicates if isinstance(predicate, CreatedIn))
+
+
+# Several queries answered by one broader query.
+class QueryFamily:
+    def __init__(self, superset: Query, labels: List[str]):
+        self.superset = superset
+        self.labels = labels
+
+    # Predicates of a member query which the superset doesn't send to YouTrack, they are checked on fetched issues.
+    def local_predicates(self, query: Query) -> List[Predicate]:
+        return [predicate for predicate in query.predicates if predicate not in self.superset.predicates]
+
+
+# Group queries which share the same base and the same "created" windows, e.g. issues created in a release
+# and the fixed ones among them. Every group is fetched once; the other predicates (e.g. StateIn) are checked locally.
+# Different windows are never merged: YouTrack evaluates dates in the profile timezone, and every release window
+# stays a query of its own in the issue cache whichever releases are configured.
+def plan(queries: Dict[str, Query]) -> List[QueryFamily]:
+    groups = {}
+    for label, query in queries.items():
+        groups.setdefault((query.base, query.windows()), []).append(label)
+    return [superset_family(queries, labels) for labels in groups.values()]
+
+
+def superset_family(queries: Dict[str, Query], labels: List[str]) -> QueryFamily:
+    if len(labels) == 1:
+        return QueryFamily(queries[labels[0]], labels)
+
+    # Predicates shared by all queries of the family (at least the window) still narrow the superset on the server
+    members = [queries[label] for label in labels]
+    shared = [predicate for predicate in members[0].predicates if all(predicate in query.predicates for query in members)]
+    return QueryFamily(Query(members[0].base, *shared), labels)
+
+
+def is_counting(handler_class: Callable[..., GetIssues]) -> bool:
+    return isinstance(handler_class, type) and issubclass(handler_class, CountIssues)
+
+
+def as_query(query: Union[Query, str]) -> Query:
+    return query if isinstance(query, Query) else Query(query)
+
+
+# Collects queries of all report sections before anything is fetched.
+# Every distinct query is run once and its handler is shared by all sections which asked for it.
+# Downloaded queries are planned into families (see plan), so adding a release doesn't add a download.
+class QueryPlanner:
+    def __init__(self, client: requests.Session, cache: IssueCache = None, max_workers: int = MAX_WORKERS):
+        self.client = client
+        self.cache = cache
+        self.max_workers = max_workers
+        self.queries: Dict[Tuple[str, Callable[..., GetIssues]], Query] = {}
+        self.projections: Dict[Tuple[str, Callable[..., GetIssues]], Projection] = {}
+        self.handlers: Dict[Tuple[str, Callable[..., GetIssues]], GetIssues] = {}
+
+    # Register a query. Projections requested by different sections for the same query are merged.
+    def add(self, query: Union[Query, str], handler_class: Callable[..., GetIssues] = GetIssues,
+            projection: Projection = DEFAULT_PROJECTION) -> Query:
+        query = as_query(query)
+        key = (query.to_youtrack(), handler_class)
+        self.queries.setdefault(key, query)
+        previous = self.projections.get(key)
+        self.projections[key] = projection if previous is None else previous.merge(projection)
+        return query
+
+    def add_all(self, queries: Dict[str, Union[Query, str]], handler_class: Callable[..., GetIssues] = GetIssues,
+                projection: Projection = DEFAULT_PROJECTION):
+        for query in queries.values():
+            self.add(query, handler_class, projection)
+
+    # Number of distinct requests to YouTrack before counting (downloads of families and counted queries).
+    def size(self) -> int:
+        downloads = {key[0]: query for key, query in self.queries.items() if not is_counting(key[1])}
+        return len(plan(downloads)) + sum(1 for key in self.queries if is_counting(key[1]))
+
+    # Download all families concurrently and create handlers for every registered query.
+    def run(self):
+        downloads = {}
+        projections = {}
+        for key, query in self.queries.items():
+            if is_counting(key[1]):
+                self.handlers[key] = key[1](self.client, key[0], cache=self.cache, projection=self.projections[key])
+            else:
+                downloads[key[0]] = query
+                projections[key[0]] = self.projections[key]
+
+        families = plan(downloads)
+        if not families:
+            return
+
+        # Fields needed to check the predicates locally are added to the projection of the superset
+        family_projections = []
+        for family in families:
+            projection = None
+            for label in family.labels:
+                projection = projections[label] if projection is None else projection.merge(projections[label])
+                for predicate in family.local_predicates(downloads[label]):
+                    projection = projection.merge(predicate.projection())
+            family_projections.append(projection)
+
+        supersets = fetch_concurrently({index: GetIssues(self.client, family.superset.to_youtrack(), cache=self.cache,
+                                                         projection=projection)
+                                        for index, (family, projection) in enumerate(zip(families, family_projections))},
+                                       GetIssues.get_issues, self.max_workers).values()
+
+        for family, projection, issues in zip(families, family_projections, supersets):
+            for label in family.labels:
+                handler = GetIssues(self.client, label, cache=self.cache, projection=projection)
+                local_predicates = family.local_predicates(downloads[label])
+                handler.issues = [issue for issue in issues if all(predicate.matches(issue) for predicate in local_predicates)]
+                self.handlers[(label, GetIssues)] = handler
+
+    # Handler of a registered query, after run().
+    def handler(self, query: Union[Query, str], handler_class: Callable[..., GetIssues] = GetIssues) -> GetIssues:
+        return self.handlers[(as_query(query).to_youtrack(), handler_class)]
+
+    # Apply `fetch` to handlers of registered queries and return results keyed by the same labels as `queries`.
+    # Counted queries are counted concurrently, downloaded ones are already in memory.
+    def fetch(self, queries: Dict[str, Union[Query, str]], fetch: Callable[[GetIssues], T],
+              handler_class: Callable[..., GetIssues] = GetIssues) -> Dict[str, T]:
+        handlers = {label: self.handler(query, handler_class) for label, query in queries.items()}
+        if not is_counting(handler_class):
+            return {label: fetch(handler) for label, handler in handlers.items()}
+        return fetch_concurrently(handlers, fetch, self.max_workers)
@@ -0,0 +1,104 @@
+﻿import json
+import re
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+CONFIG_FILE = "report_config.json"
+
+# Release entries which sections query, every release of such a section must have them.
+# fixed_in_bugfix only needs the version of the release.
+REQUIRED_RELEASE_FIELDS = {
+    "created_by_users_after_release": ["after_release"],
+    "created_by_users_in_bugfix": ["bugfixes"],
+}
+
+
+# Dates in the YouTrack format: "2024-04-10 .. 2024-08-14", both days are included.
+def parse_dates(dates: str) -> Tuple[datetime, datetime]:
+    start, end = [part.strip() for part in dates.split("..")]
+    return datetime.strptime(start, "%Y-%m-%d"), datetime.strptime(end, "%Y-%m-%d")
+
+
+class Bugfix:
+    def __init__(self, name: str, dates: str):
+        self.name = name
+        self.dates = dates
+
+
+class Release:
+    def __init__(self, name: str, version: str, cycle: str, after_release: str = None, bugfixes: List[dict] = None):
+        self.name = name
+        # e.g. "2024.2", bugfix versions are "2024.2.*"
+        self.version = version
+        # Dates of the release cycle, issues created in them are counted for the release
+        self.cycle = cycle
+        # First weeks after the release
+        self.after_release = after_release
+        self.bugfixes = [Bugfix(**bugfix) for bugfix in bugfixes or []]
+
+    @property
+    def start(self) -> datetime:
+        return parse_dates(self.cycle)[0]
+
+    @property
+    def end(self) -> datetime:
+        return parse_dates(self.cycle)[1]
+
+    # "Available in" value of bugfix versions, e.g. "2024.2.*"
+    @property
+    def bugfix_versions(self) -> str:
+        return f"{self.version}.*"
+
+    # First bugfix version from an "Available in" value, e.g. "2024.2.1" from "2024.2.1, 2024.3"
+    def extract_bugfix_version(self, available_in: str) -> Optional[str]:
+        match = re.search(re.escape(self.version) + r'\.[^\s,]*', available_in)
+        return match.group(0) if match else None
+
+
+class SectionConfig:
+    def __init__(self, name: str, enabled: bool = True, releases: List[str] = None, **options):
+        self.name = name
+        self.enabled = enabled
+        self.releases = releases or []
+        # Options specific to the section
+        self.options = options
+
+
+# Output of charts. processes: number of rendering processes (all cores by default, 0 draws charts in the report process).
+# cache: reuse images of charts whose data and settings haven't changed since they were drawn.
+class ChartsConfig:
+    def __init__(self, format: str = "png", dpi: int = 100, processes: int = None, cache: bool = True):
+        self.format = format
+        self.dpi = dpi
+        self.processes = processes
+        self.cache = cache
+
+
+class ReportConfig:
+    def __init__(self, project: str, releases: List[dict], sections: List[dict], charts: dict = None,
+                 server_side_counts: bool = False):
+        self.project = project
+        # Count issues of count-only sections with YouTrack count requests instead of downloading them
+        self.server_side_counts = server_side_counts
+        self.charts = ChartsConfig(**(charts or {}))
+        self.releases: Dict[str, Release] = {release["name"]: Release(**release) for release in releases}
+        self.sections = [SectionConfig(**section) for section in sections]
+
+        for section in self.sections:
+            for release in section.releases:
+                if release not in self.releases:
+                    raise ValueError(f"Section {section.name} refers to unknown release {release}")
+                for field in REQUIRED_RELEASE_FIELDS.get(section.name, []):
+                    if not getattr(self.releases[release], field):
+                        raise ValueError(f"Section {section.name} needs {field} of release {release}")
+
+    def releases_of(self, section: SectionConfig) -> List[Release]:
+        return [self.releases[name] for name in section.releases]
+
+    def enabled_sections(self) -> List[SectionConfig]:
+        return [section for section in self.sections if section.enabled]
+
+
+def load_config(path: str = CONFIG_FILE) -> ReportConfig:
+    with open(path, encoding="utf-8") as file:
+        return ReportConfig(**json.load(file))
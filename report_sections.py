@@ -0,0 +1,427 @@
+﻿import functools
+import hashlib
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Callable, Tuple
+
+import ai_analysis
+from ai_analysis import ask_ai_issues_by_types, ask_ai_issues_by_priorities_2_weeks, ask_ai_issues_between_bugfixes, split_dict
+
+import instrumentation
+from instrumentation import in_current_context
+
+from markdown_writer import Fragment, append_markdown, write_table, fragment
+
+from charts import ChartRenderer, plotter_code_hash
+
+import youtrack
+from youtrack import GetIssues, Projection, CommentFilter, is_user_email
+
+from issue_cache import refresh_period
+
+from query_planner import Query, CreatedIn, StateIn, QueryPlanner, is_counting
+
+from report_config import ReportConfig, SectionConfig
+
+JETBRAINS_TEAM_QUERY = "created by: jetbrains-team and created by: -dotnet-support"
+USERS_QUERY = "created by: -jetbrains-team or created by: dotnet-support"
+FIXED_STATES = ["fixed", "Verified"]
+
+# Modules whose code shapes the fragments: the sections themselves, release dates, parsing, planning
+# and aggregation of issues, and markdown output. Charts are covered by plotter_code_hash().
+CODE_MODULES = ["report_sections", "report_config", "youtrack", "query_planner", "issue_table", "markdown_writer"]
+MODULES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def module_code_hash(module: str) -> str:
+    with open(os.path.join(MODULES_DIR, f"{module}.py"), "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+# Part of the report. Sections register their queries in the planner first,
+# so queries shared by several sections are run once, then write the report from the shared results.
+class Section:
+    name = None
+    # Names of the ai_analysis prompt templates the section sends
+    prompts: List[str] = []
+
+    def __init__(self, config: ReportConfig, section: SectionConfig, counts_handler: Callable[..., GetIssues],
+                 renderer: ChartRenderer):
+        self.config = config
+        self.section = section
+        self.releases = config.releases_of(section)
+        # CountIssues or GetIssues for sections which only need counts
+        self.counts_handler = counts_handler
+        # Charts are drawn in other processes, a section submits all its charts before waiting for them
+        self.renderer = renderer
+
+    @property
+    def project_query(self) -> str:
+        return f"project:{self.config.project}"
+
+    # Count-only queries are counted by YouTrack, otherwise their issues are downloaded into an IssueTable.
+    @property
+    def counts_on_server(self) -> bool:
+        return is_counting(self.counts_handler)
+
+    # Bugs of the queries by priority: labels of the queries and a matrix with one row per query and one column per priority.
+    def bugs_by_priority(self, planner: QueryPlanner, queries: Dict[str, Query]) -> tuple:
+        # NumPy is only loaded by sections which aggregate issues
+        from issue_table import IssueTable, counts_matrix
+
+        if self.counts_on_server:
+            counts = planner.fetch(queries, GetIssues.get_bugs_by_priority, self.counts_handler)
+            return list(counts), counts_matrix(list(counts.values()), youtrack.PRIORITIES)
+
+        table = IssueTable.from_issues(planner.fetch(queries, GetIssues.get_issues))
+        labels, _, matrix = table.pivot(youtrack.PRIORITY, table.bugs(), youtrack.PRIORITIES)
+        return labels, matrix
+
+    def register(self, planner: QueryPlanner):
+        pass
+
+    # Queries the section runs itself instead of registering them in the planner, as (query, fields) pairs.
+    def streamed_queries(self) -> List[Tuple[str, str]]:
+        return []
+
+    # Everything the fragment of the section depends on, except the data of its queries and the AI answers.
+    # The section is rebuilt when any of them changes, see section_graph.py.
+    def inputs(self) -> Dict[str, object]:
+        planner = QueryPlanner(None)
+        self.register(planner)
+        queries = [[query, handler_class.__name__, projection.params()]
+                   for (query, handler_class), projection in planner.projections.items()]
+        queries.extend([query, GetIssues.__name__, fields] for query, fields in self.streamed_queries())
+        periods = [period for period in (refresh_period(query, fields) for query, _, fields in queries) if period is not None]
+        return {
+            "config": {"project": self.config.project, "releases": self.section.releases, "options": self.section.options},
+            "releases": [dict(vars(release), bugfixes=[vars(bugfix) for bugfix in release.bugfixes])
+                         for release in self.releases],
+            "queries": queries,
+            # Recent issues (and states of older ones) still change, such sections are refreshed as often as the issue cache
+            "live_data": int(time.time() // min(periods)) if periods else None,
+            "prompts": {name: getattr(ai_analysis, name) for name in self.prompts},
+            "code": self.code(),
+            # Rendering processes and the chart cache don't change the images
+            "charts": {"format": self.config.charts.format, "dpi": self.config.charts.dpi},
+        }
+
+    # Hashes of the code the fragment depends on. Sections sending prompts depend on the AI code as well.
+    def code(self) -> Dict[str, str]:
+        modules = CODE_MODULES + ["ai_analysis"] if self.prompts else CODE_MODULES
+        code = {module: module_code_hash(module) for module in modules}
+        code["plotter"] = plotter_code_hash()
+        return code
+
+    def write(self, planner: QueryPlanner):
+        raise NotImplementedError
+
+
+# Options: "chart" ("bars" or "heatmap"), "top" (number of subsystems shown, the others are summed up as "Other"),
+# "rank_by" (top subsystems by "total" issues or by "delta" between the first and the last release)
+# and "page_size" (subsystems per bar chart, more of them are split into several charts).
+class IssuesBySubsystems(Section):
+    name = "issues_by_subsystems"
+    charts = ["bars", "heatmap"]
+    page_size = 40
+
+    def queries(self) -> Dict[str, Query]:
+        return {f"Release {release.name}": Query(self.project_query, CreatedIn(release.cycle)) for release in self.releases}
+
+    def register(self, planner: QueryPlanner):
+        planner.add_all(self.queries(), projection=Projection([youtrack.PRIORITY, youtrack.SUBSYSTEM]))
+
+    def write(self, planner: QueryPlanner):
+        append_markdown("## Issues Created By Subsystems")
+
+        # NumPy is only loaded by this section
+        from issue_table import IssueTable, top_categories, pages
+
+        chart = self.section.options.get("chart", "bars")
+        if chart not in self.charts:
+            raise ValueError(f"Unknown chart of {self.name}: {chart}, expected one of {self.charts}")
+
+        issues = planner.fetch(self.queries(), GetIssues.get_issues)
+        table = IssueTable.from_issues(issues)
+
+        subsystems = sorted(table.labels(youtrack.SUBSYSTEM))
+        releases, subsystems, created_by_subsystem = table.pivot(youtrack.SUBSYSTEM, categories=subsystems)
+        subsystems, created_by_subsystem = top_categories(subsystems, created_by_subsystem, self.section.options.get("top"),
+                                                          self.section.options.get("rank_by", "total"))
+
+        title = "Issues created by subsystems"
+        if chart == "heatmap":
+            subsystem_plots = [self.renderer.submit("plot_heatmap", releases, subsystems, created_by_subsystem, title,
+                                                    youtrack.SUBSYSTEM)]
+        else:
+            subsystem_pages = pages(subsystems, created_by_subsystem, self.section.options.get("page_size", self.page_size))
+            subsystem_plots = [self.renderer.submit("plot_matrix", releases, page_subsystems, page_counts,
+                                                    title if len(subsystem_pages) == 1 else f"{title} ({page} of {len(subsystem_pages)})",
+                                                    youtrack.SUBSYSTEM)
+                               for page, (page_subsystems, page_counts) in enumerate(subsystem_pages, 1)]
+
+        releases, priorities, created_by_priority = table.pivot(youtrack.PRIORITY, categories=youtrack.PRIORITIES)
+        plot4 = self.renderer.submit("plot_matrix", releases, priorities, created_by_priority,
+                                     "Issues created by priority", youtrack.PRIORITY)
+
+        for plot3 in subsystem_plots:
+            append_markdown("![Issues created 'by subsystem'](images/" + os.path.basename(plot3.result()) + ")")
+        append_markdown("![Issues created by priority](images/" + os.path.basename(plot4.result()) + ")")
+
+
+class CreatedByJetbrainsTeamVsFixed(Section):
+    name = "created_by_jetbrains_team_vs_fixed"
+
+    def queries(self) -> Dict[str, Query]:
+        base_query = f"{self.project_query} and ({JETBRAINS_TEAM_QUERY})"
+        return {f"Release {release.name}": Query(base_query, CreatedIn(release.cycle)) for release in self.releases}
+
+    # Fixed tickets created by jetbrains-team. When issues are downloaded, the planner fetches them with the created
+    # issues of the same release and checks the state locally.
+    def fixed_queries(self) -> Dict[str, Query]:
+        return {label: Query(query.base, *query.predicates, StateIn(*FIXED_STATES)) for label, query in self.queries().items()}
+
+    def register(self, planner: QueryPlanner):
+        planner.add_all(self.queries(), self.counts_handler, Projection([youtrack.PRIORITY, youtrack.TYPE]))
+        planner.add_all(self.fixed_queries(), self.counts_handler, Projection([youtrack.PRIORITY, youtrack.TYPE]))
+
+    # Created and fixed matrices (one row per release, one column per category) of priorities and of types.
+    def created_and_fixed(self, planner: QueryPlanner) -> Dict[str, tuple]:
+        # NumPy is only loaded by sections which aggregate issues
+        from issue_table import IssueTable, counts_matrix
+
+        columns = {youtrack.PRIORITY: youtrack.PRIORITIES, youtrack.TYPE: youtrack.TYPES}
+        if self.counts_on_server:
+            count = lambda handler: handler.count_issues_by(*columns)
+            created = planner.fetch(self.queries(), count, self.counts_handler)
+            fixed = planner.fetch(self.fixed_queries(), count, self.counts_handler)
+            return {column: (counts_matrix([counts[column] for counts in created.values()], categories),
+                             counts_matrix([counts[column] for counts in fixed.values()], categories))
+                    for column, categories in columns.items()}
+
+        created = IssueTable.from_issues(planner.fetch(self.queries(), GetIssues.get_issues))
+        fixed = IssueTable.from_issues(planner.fetch(self.fixed_queries(), GetIssues.get_issues))
+        return {column: (created.pivot(column, categories=categories)[2], fixed.pivot(column, categories=categories)[2])
+                for column, categories in columns.items()}
+
+    def write(self, planner: QueryPlanner):
+        # Get tickets created by jetbrains-team
+        append_markdown("## Issues Created By jetbrains-team vs Fixed")
+
+        matrices = self.created_and_fixed(planner)
+        releases = [f"Release {release.name}" for release in self.releases]
+        releases_with_dates = [f"Release {release.name} (created: {release.cycle})" for release in self.releases]
+
+        plot1 = self.renderer.submit("plot_created_vs_fixed_matrix", releases_with_dates, youtrack.PRIORITIES,
+                                     *matrices[youtrack.PRIORITY],
+                                     "Distribution of issues by priorities (created by jetbrains-team vs fixed)")
+        plot2 = self.renderer.submit("plot_created_vs_fixed_matrix", releases, youtrack.TYPES, *matrices[youtrack.TYPE],
+                                     "Distribution of issues by types (created by jetbrains-team vs fixed)")
+
+        append_markdown("![Issues created by jetbrains-team by priority](images/" + os.path.basename(plot1.result()) + ")")
+        append_markdown("![Issues created by jetbrains-team by types](images/" + os.path.basename(plot2.result()) + ")")
+
+        # # Send data to AI
+        # append_markdown("## AI analysis for issues created by jetbrains-team")
+        # created, fixed = matrices[youtrack.PRIORITY]
+        # ai_response = ask_ai_issues_by_types(
+        #     {label: dict(zip(youtrack.PRIORITIES, row.tolist())) for label, row in zip(releases_with_dates, created)},
+        #     {label: dict(zip(youtrack.PRIORITIES, row.tolist())) for label, row in zip(releases_with_dates, fixed)})
+        # append_markdown(f"\n{ai_response}\n")
+
+
+# Bugs created by users 2 weeks after release "project: resharper created by: -jetbrains-team created: 2024-08-15 .. today sort by: priority"
+class CreatedByUsersAfterRelease(Section):
+    name = "created_by_users_after_release"
+
+    def queries(self) -> Dict[str, Query]:
+        base_query = f"{self.project_query} and ({USERS_QUERY})"
+        return {f"Release {release.name} (created: {release.after_release})": Query(base_query, CreatedIn(release.after_release))
+                for release in self.releases}
+
+    def register(self, planner: QueryPlanner):
+        planner.add_all(self.queries(), self.counts_handler, Projection([youtrack.PRIORITY, youtrack.TYPE]))
+
+    def write(self, planner: QueryPlanner):
+        append_markdown("## Issues created by users 2 weeks after the release")
+
+        labels, bugs_by_priority = self.bugs_by_priority(planner, self.queries())
+
+        plot3 = self.renderer.submit("plot_matrix", labels, youtrack.PRIORITIES, bugs_by_priority,
+                                     "Issues created by users 2 weeks after the release", youtrack.PRIORITY)
+        append_markdown("![Issues created by jetbrains-team by priority](images/" + os.path.basename(plot3.result()) + ")")
+
+        # # Send data to AI
+        # append_markdown("## AI analysis for issues created by users 2 weeks after release")
+        # ai_response = ask_ai_issues_by_priorities_2_weeks(
+        #     {label: dict(zip(youtrack.PRIORITIES, row.tolist())) for label, row in zip(labels, bugs_by_priority)})
+        # append_markdown(f"\n{ai_response}\n")
+
+
+# Bugs created by users between bugfixes of a release
+class CreatedByUsersInBugfix(Section):
+    name = "created_by_users_in_bugfix"
+
+    def queries(self, release) -> Dict[str, Query]:
+        base_query = f"{self.project_query} and ({USERS_QUERY})"
+        return {bugfix.name: Query(base_query, CreatedIn(bugfix.dates)) for bugfix in release.bugfixes}
+
+    def register(self, planner: QueryPlanner):
+        for release in self.releases:
+            planner.add_all(self.queries(release), self.counts_handler, Projection([youtrack.PRIORITY, youtrack.TYPE]))
+
+    def write(self, planner: QueryPlanner):
+        for release in self.releases:
+            append_markdown(f"## Issues created by users in {release.name} release between bugfixes")
+
+            labels, created_by_users = self.bugs_by_priority(planner, self.queries(release))
+
+            plot4 = self.renderer.submit("plot_matrix", labels, youtrack.PRIORITIES, created_by_users,
+                                         f"Issues created by users in {release.name} between bugfixes", youtrack.PRIORITY)
+            append_markdown("![Issues created by jetbrains-team by priority](images/" + os.path.basename(plot4.result()) + ")")
+
+            # # Send data to AI
+            # append_markdown("## AI analysis for issues created by users between bugfixes")
+            # ai_response = ask_ai_issues_between_bugfixes(
+            #     {label: dict(zip(youtrack.PRIORITIES, row.tolist())) for label, row in zip(labels, created_by_users)})
+            # append_markdown(f"\n{ai_response}\n")
+
+
+# Issues fixed in bugfix: Available in: 2024.2.*
+class FixedInBugfix(Section):
+    name = "fixed_in_bugfix"
+
+    def query(self, release) -> str:
+        available_in_bugfix = f"Available in: {release.bugfix_versions}"
+        additional_query = "#resolved"
+        return f"{self.project_query} and {available_in_bugfix} and ({additional_query})"
+
+    def register(self, planner: QueryPlanner):
+        for release in self.releases:
+            planner.add(self.query(release), projection=Projection(["Available in", youtrack.SUBSYSTEM, youtrack.PRIORITY]))
+
+    def write(self, planner: QueryPlanner):
+        for release in self.releases:
+            append_markdown(f"## Issues which were fixed in {release.name} bugfixes")
+
+            issues_available_in_bugfix = planner.handler(self.query(release)).get_issues()
+
+            # Sort the issues first by "Available in" (filtered for bugfix versions), then by "Subsystem", and lastly by "Priority"
+            sorted_issues = sorted(
+                issues_available_in_bugfix,
+                key=lambda issue: (
+                    release.extract_bugfix_version(issue.available_in) if issue.available_in else "",
+                    issue.subsystem if issue.subsystem else "",
+                    youtrack.PRIORITIES.index(issue.priority) if issue.priority in youtrack.PRIORITIES else len(youtrack.PRIORITIES)  # Sort by priority based on its index in PRIORITIES
+                )
+            )
+
+            # Prepare table data
+            headers = ["Available in", "Subsystem", "Priority", "Summary"]
+            rows = []
+
+            for issue in sorted_issues:
+                # Extract only the bugfix version to display
+                available_in_value = release.extract_bugfix_version(issue.available_in) if issue.available_in else None
+                if available_in_value:
+                    rows.append([
+                        available_in_value,
+                        issue.subsystem if issue.subsystem else "N/A",
+                        issue.priority if issue.priority else "N/A",
+                        issue.summary,
+                    ])
+
+            # Write the table to markdown
+            write_table(headers, rows)
+
+
+# Get users comments added during release cycle
+class UsersComments(Section):
+    name = "users_comments"
+    prompts = ["AI_SYSTEM_MESSAGE", "AI_COMMENTS_MESSAGE"]
+    projection = Projection(fields=["idReadable"])
+
+    def query(self, release) -> str:
+        commented = f"commented: {release.cycle}"
+        # additional_query = "#unresolved"
+        return f"{self.project_query} and ({commented}) "
+
+    def streamed_queries(self) -> List[Tuple[str, str]]:
+        return [(self.query(release), self.projection.params()) for release in self.releases]
+
+    # Comments are streamed issue by issue and filtered while they are parsed, so they don't go through the planner.
+    # With "comments": "windowed" they are requested per issue, and YouTrack only sends the ones within the release cycle.
+    def write(self, planner: QueryPlanner):
+        windowed = self.section.options.get("comments", "streamed")
+        if windowed not in ("streamed", "windowed"):
+            raise ValueError(f"Unknown comments option of {self.name}: {windowed}")
+        windowed = windowed == "windowed"
+
+        for release in self.releases:
+            append_markdown(f"## Users comments added during {release.name} release cycle")
+
+            query = self.query(release)
+
+            # Only users' comments added during the release cycle are kept while issues are decoded one by one
+            comment_filter = CommentFilter.between(release.start, release.end, author=is_user_email)
+            issues_handler = GetIssues(planner.client, query, cache=planner.cache, stream=True,
+                                       projection=self.projection)
+            if windowed:
+                issues = issues_handler.iter_issues_with_windowed_comments(comment_filter)
+            else:
+                issues = issues_handler.iter_issues_with_comments(comment_filter)
+
+            issue_comments_data = defaultdict(list)
+            for issue in issues:
+                for comment in issue.comments:
+                    issue_comments_data[issue.id].append(comment['text'])
+
+            if not issue_comments_data:
+                append_markdown("No comments from users were added during the release cycle.")
+                continue
+
+            # Split the data into at most num_splits parts, which are analyzed concurrently
+            num_splits = 4
+            chunk_size = -(-len(issue_comments_data) // num_splits)
+            issue_comments_data_chunks = list(split_dict(issue_comments_data, chunk_size))
+            ai_responses, final_response = ai_analysis.ask_ai_about_comments_in_chunks(issue_comments_data_chunks)
+
+            for i, ai_response_part in enumerate(ai_responses):
+                append_markdown(f"## AI analysis for user's comments in {release.name} (Part {i})")
+                append_markdown(f"\n{ai_response_part}\n")
+
+            append_markdown(f"## AI analysis for user's comments in {release.name} (final)")
+            append_markdown(f"\n{final_response}\n")
+
+
+SECTIONS = {section.name: section for section in [IssuesBySubsystems, CreatedByJetbrainsTeamVsFixed,
+                                                   CreatedByUsersAfterRelease, CreatedByUsersInBugfix, FixedInBugfix,
+                                                   UsersComments]}
+
+
+# Sections enabled in the config (or the named ones, enabled or not), in the configured order.
+def create_sections(config: ReportConfig, counts_handler: Callable[..., GetIssues], renderer: ChartRenderer,
+                    names: List[str] = None) -> List[Section]:
+    sections = []
+    for section in config.sections:
+        if not (section.enabled if names is None else section.name in names):
+            continue
+        if section.name not in SECTIONS:
+            raise ValueError(f"Unknown report section: {section.name}")
+        sections.append(SECTIONS[section.name](config, section, counts_handler, renderer))
+    return sections
+
+
+# Run sections concurrently, each of them writes into its own fragment.
+# Fragments are returned in the order of the sections, whichever section finishes first.
+def run_sections(sections: List[Section], planner: QueryPlanner, max_workers: int = None) -> List[Fragment]:
+    def run(section: Section) -> Fragment:
+        with fragment() as section_fragment, instrumentation.span(section.name, "section"):
+            section.write(planner)
+        return section_fragment
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(sections))) as executor:
+        return list(executor.map(in_current_context(run), sections))
@@ -0,0 +1,86 @@
+﻿import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import List, Dict
+
+from markdown_writer import Fragment, REPORTS_DIR
+
+from report_sections import Section
+
+STATE_DIR = os.path.join(REPORTS_DIR, "fragments")
+STATE_FILE = "state.json"
+
+# Images which a fragment links to, relative to the report. File names may contain parentheses,
+# links are the last thing on their line.
+IMAGE_LINK = re.compile(r'\]\((images/.+)\)\s*$', re.MULTILINE)
+
+
+def fingerprint(value) -> str:
+    data = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def write_atomic(path: str, text: str):
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp")
+    with os.fdopen(handle, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+# Sections with the fingerprints of their inputs. Fragments of built sections are saved with the fingerprints,
+# so the next run rebuilds only sections whose inputs changed and takes the rest from the saved fragments.
+# `source` describes where YouTrack data comes from (live server, fixtures or synthetic issues), all sections depend on it.
+class SectionGraph:
+    def __init__(self, sections: List[Section], source: str, state_dir: str = STATE_DIR):
+        self.sections = sections
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, STATE_FILE)
+        self.fingerprints: Dict[str, Dict[str, str]] = {}
+        for section in sections:
+            inputs = dict(section.inputs(), source=source)
+            self.fingerprints[section.name] = {name: fingerprint(value) for name, value in inputs.items()}
+
+        # Section name -> fingerprints of the inputs its saved fragment was built from
+        self.state: Dict[str, Dict[str, str]] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as file:
+                self.state = json.load(file)
+
+    def fragment_path(self, section: Section) -> str:
+        return os.path.join(self.state_dir, f"{section.name}.md")
+
+    def has_fragment(self, section: Section) -> bool:
+        return section.name in self.state and os.path.exists(self.fragment_path(section))
+
+    # Names of the inputs which changed since the saved fragment was built, empty if it can be reused.
+    def changed_inputs(self, section: Section) -> List[str]:
+        if not self.has_fragment(section):
+            return ["fragment"]
+        saved = self.state[section.name]
+        current = self.fingerprints[section.name]
+        changed = sorted(name for name in current.keys() | saved.keys() if current.get(name) != saved.get(name))
+        if not changed:
+            with open(self.fragment_path(section), encoding="utf-8") as file:
+                images = IMAGE_LINK.findall(file.read())
+            if any(not os.path.exists(os.path.join(REPORTS_DIR, image)) for image in images):
+                changed.append("images")
+        return changed
+
+    # Sections (of the given ones) to build in this run, all of them with `rebuild`.
+    def stale(self, sections: List[Section] = None, rebuild: bool = False) -> List[Section]:
+        return [section for section in sections or self.sections if rebuild or self.changed_inputs(section)]
+
+    def cached_fragment(self, section: Section) -> Fragment:
+        with open(self.fragment_path(section), encoding="utf-8") as file:
+            return Fragment.from_text(file.read())
+
+    # Save fragments of built sections, the state is written after them so it never refers to a missing fragment.
+    def save(self, fragments: Dict[str, Fragment]):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for section in self.sections:
+            if section.name in fragments:
+                write_atomic(self.fragment_path(section), fragments[section.name].text())
+                self.state[section.name] = self.fingerprints[section.name]
+        write_atomic(self.state_path, json.dumps(self.state, indent=1))
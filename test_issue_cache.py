@@ -0,0 +1,59 @@
+﻿import time
+
+import pytest
+
+from issue_cache import IssueCache, CacheEntry, refresh_period, DEFAULT_TTL, MUTABLE_TTL
+from youtrack import Projection
+
+QUERY = "project:ReSharper and created: 2023-04-05 .. 2023-08-01"
+FIELDS = Projection(["Priority"]).params()
+
+
+@pytest.fixture
+def cache(tmp_path) -> IssueCache:
+    return IssueCache(str(tmp_path / "cache.sqlite"))
+
+
+def issue(issue_id: str, priority: str = "Normal") -> dict:
+    return {"idReadable": issue_id, "customFields": [{"name": "Priority", "value": {"name": priority}}]}
+
+
+def test_store_passes_issues_through_and_reads_them_back(cache):
+    issues = [issue(f"A-{n}") for n in range(5)]
+    assert cache.get(QUERY, FIELDS) is None
+    assert list(cache.store(QUERY, FIELDS, iter(issues))) == issues
+    assert cache.get(QUERY, FIELDS) is not None
+    assert list(cache.iter_issues(QUERY, FIELDS)) == issues
+    assert list(cache.iter_issues(QUERY, Projection(["State"]).params())) == []
+
+
+def test_interrupted_store_is_not_cached(cache):
+    stored = cache.store(QUERY, FIELDS, iter([issue("A-1"), issue("A-2")]))
+    next(stored)
+    stored.close()
+    assert cache.get(QUERY, FIELDS) is None
+
+
+def test_update_replaces_updated_issues_and_drops_the_ones_which_stopped_matching(cache):
+    list(cache.store(QUERY, FIELDS, iter([issue("A-1"), issue("A-2"), issue("A-3")])))
+    entry = cache.get(QUERY, FIELDS)
+    updated = cache.update(QUERY, FIELDS, entry, iter([issue("A-2", "Major"), issue("A-4")]), {"A-1", "A-2", "A-4"})
+    assert updated.fetched_at == entry.fetched_at
+    assert updated.synced_at >= entry.synced_at
+    assert {cached["idReadable"]: cached["customFields"][0]["value"]["name"] for cached in cache.iter_issues(QUERY, FIELDS)} == \
+        {"A-1": "Normal", "A-2": "Major", "A-4": "Normal"}
+
+
+def test_refresh_period_of_closed_windows_depends_on_mutable_fields():
+    open_window = time.strftime("project:ReSharper and created: 2020-01-01 .. %Y-%m-%d")
+    assert refresh_period(open_window, FIELDS) == DEFAULT_TTL
+    assert refresh_period(QUERY, FIELDS) is None
+    assert refresh_period(QUERY, Projection(["Priority", "State"]).params()) == MUTABLE_TTL
+    assert refresh_period(f"{QUERY} and (state: fixed or state: Verified)", FIELDS) == MUTABLE_TTL
+    assert refresh_period("project:ReSharper and #resolved", FIELDS) == DEFAULT_TTL
+
+
+def test_cache_entry_expires_after_its_ttl():
+    assert CacheEntry(0, 100, None).is_fresh(now=10 ** 10)
+    assert CacheEntry(0, 100, 60).is_fresh(now=159)
+    assert not CacheEntry(0, 100, 60).is_fresh(now=160)
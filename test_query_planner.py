@@ -0,0 +1,58 @@
+﻿import youtrack
+from youtrack import GetIssues, CountIssues, Projection
+from query_planner import Query, CreatedIn, StateIn, QueryPlanner, plan
+
+BASE = "project:ReSharper and (created by: jetbrains-team and created by: -dotnet-support)"
+WINDOWS = ["2023-04-05 .. 2023-08-01", "2023-08-02 .. 2023-12-06"]
+FIXED = StateIn("fixed", "Verified")
+
+
+def created_and_fixed() -> dict:
+    queries = {}
+    for window in WINDOWS:
+        queries[f"created {window}"] = Query(BASE, CreatedIn(window))
+        queries[f"fixed {window}"] = Query(BASE, CreatedIn(window), FIXED)
+    return queries
+
+
+def test_plan_groups_queries_of_the_same_window():
+    queries = created_and_fixed()
+    families = plan(queries)
+    assert [family.labels for family in families] == [[f"created {window}", f"fixed {window}"] for window in WINDOWS]
+    for family, window in zip(families, WINDOWS):
+        assert family.superset.to_youtrack() == queries[f"created {window}"].to_youtrack()
+        assert family.local_predicates(queries[f"created {window}"]) == []
+        assert family.local_predicates(queries[f"fixed {window}"]) == [FIXED]
+
+
+def test_plan_never_merges_different_bases_or_windows():
+    queries = {"a": Query(BASE, CreatedIn(WINDOWS[0]), FIXED), "b": Query(BASE, CreatedIn(WINDOWS[1]), FIXED),
+               "c": Query("project:ReSharper", CreatedIn(WINDOWS[0]), FIXED)}
+    families = plan(queries)
+    assert [family.labels for family in families] == [["a"], ["b"], ["c"]]
+    assert all(family.local_predicates(queries[family.labels[0]]) == [] for family in families)
+
+
+def test_planner_downloads_a_window_once_and_filters_locally(client):
+    queries = created_and_fixed()
+    planner = QueryPlanner(client)
+    planner.add_all(queries, projection=Projection([youtrack.PRIORITY]))
+    assert planner.size() == len(WINDOWS)
+    planner.run()
+
+    for label, query in queries.items():
+        planned = planner.fetch({label: query}, GetIssues.get_issues)[label]
+        direct = GetIssues(client, query.to_youtrack(), projection=Projection([youtrack.PRIORITY, youtrack.STATE])).get_issues()
+        assert [(issue.id, issue.priority) for issue in planned] == [(issue.id, issue.priority) for issue in direct]
+        assert planned
+
+
+def test_planner_counts_match_downloads(client):
+    queries = created_and_fixed()
+    results = {}
+    for handler_class in (GetIssues, CountIssues):
+        planner = QueryPlanner(client)
+        planner.add_all(queries, handler_class, Projection([youtrack.PRIORITY, youtrack.TYPE]))
+        planner.run()
+        results[handler_class] = planner.fetch(queries, GetIssues.get_bugs_by_priority, handler_class)
+    assert results[CountIssues] == results[GetIssues]
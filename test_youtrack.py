@@ -0,0 +1,83 @@
+﻿import json
+from datetime import datetime
+
+import pytest
+
+import youtrack
+from youtrack import GetIssues, CountIssues, CommentFilter, Projection, iter_json_array, is_user_email
+
+PROJECT_QUERY = "project:ReSharper and (created by: jetbrains-team and created by: -dotnet-support)"
+WINDOWS = ["2023-04-05 .. 2023-08-01", "2023-12-07 .. 2024-04-09"]
+
+
+# Split text into chunks at the given positions.
+def split(text: str, positions: list) -> list:
+    bounds = [0] + list(positions) + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+ELEMENTS = [{"id": "A-1", "summary": "brackets ] [ and, commas", "n": 1}, {"id": "A-2", "nested": {"list": [1, 2]}},
+            {"id": "A-3", "text": 'escaped " quote and \u00e9'}]
+
+
+def test_iter_json_array_at_every_chunk_boundary():
+    text = json.dumps(ELEMENTS, indent=1)
+    for position in range(1, len(text)):
+        assert list(iter_json_array(iter(split(text, [position])))) == ELEMENTS
+
+
+def test_iter_json_array_from_single_characters():
+    assert list(iter_json_array(iter(json.dumps(ELEMENTS)))) == ELEMENTS
+    assert list(iter_json_array(iter(" [ ] "))) == []
+
+
+def test_iter_json_array_rejects_truncated_and_other_values():
+    text = json.dumps(ELEMENTS)
+    with pytest.raises(ValueError):
+        list(iter_json_array(iter([text[:-5]])))
+    with pytest.raises(ValueError):
+        list(iter_json_array(iter(['{"id": 1}'])))
+
+
+def test_comment_filter_window_includes_both_ends():
+    comment_filter = CommentFilter(100, 200, author=is_user_email)
+    user = {"author": {"email": "user@example.com"}}
+    assert comment_filter.accepts(dict(user, created=100))
+    assert comment_filter.accepts(dict(user, created=200))
+    assert not comment_filter.accepts(dict(user, created=99))
+    assert not comment_filter.accepts(dict(user, created=201))
+    assert not comment_filter.accepts({"author": {"email": "dev@jetbrains.com"}, "created": 150})
+    assert not comment_filter.accepts(dict(user))
+    assert CommentFilter().accepts({})
+
+
+@pytest.mark.parametrize("query", [f"{PROJECT_QUERY} and created: {window}" for window in WINDOWS] +
+                         [f"{PROJECT_QUERY} and created: {WINDOWS[0]} and (state: fixed or state: Verified)"])
+def test_count_issues_matches_downloaded_counts(client, query):
+    aggregations = [youtrack.PRIORITY, youtrack.TYPE, youtrack.BUG_PRIORITY]
+    projection = Projection([youtrack.PRIORITY, youtrack.TYPE, youtrack.STATE])
+    downloaded = GetIssues(client, query, projection=projection).count_issues_by(*aggregations)
+    counted = CountIssues(client, query, projection=projection).count_issues_by(*aggregations)
+    assert counted == downloaded
+    assert sum(downloaded[youtrack.PRIORITY].values()) > 0
+
+
+def test_stream_mode_returns_the_same_issues(client):
+    query = f"{PROJECT_QUERY} and created: {WINDOWS[0]}"
+    projection = Projection([youtrack.PRIORITY, youtrack.STATE])
+    pages = [(issue.id, issue.priority, issue.state) for issue in GetIssues(client, query, page_size=7, projection=projection).get_issues()]
+    streamed = [(issue.id, issue.priority, issue.state)
+                for issue in GetIssues(client, query, page_size=7, stream=True, projection=projection).get_issues()]
+    assert streamed == pages
+
+
+def test_windowed_comments_match_filtered_stream(client):
+    query = "project:ReSharper and commented: 2024-04-10 .. 2024-04-24"
+    comment_filter = CommentFilter.between(datetime(2024, 4, 10), datetime(2024, 4, 24), author=is_user_email)
+    start, end = comment_filter.start, comment_filter.end
+    handler = GetIssues(client, query, stream=True, projection=Projection(fields=["idReadable"]))
+    streamed = {issue.id: issue.comments for issue in handler.iter_issues_with_comments(comment_filter)}
+    windowed = {issue.id: issue.comments for issue in handler.iter_issues_with_windowed_comments(comment_filter)}
+    assert windowed == streamed
+    comments = [comment for issue_comments in streamed.values() for comment in issue_comments]
+    assert comments and all(start <= comment["created"] <= end and is_user_email(comment["author"]) for comment in comments)
@@ -0,0 +1,121 @@
+﻿import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses which are worth repeating after a pause.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# (connect, read) timeouts in seconds.
+TIMEOUT = (10, 120)
+RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Connections kept per host. Queries run in parallel and each of them may count issues in parallel too.
+POOL_SIZE = 32
+
+# Requests per second allowed on average and the burst allowed above it.
+RATE = 10.0
+BURST = 20
+
+
+# Client-side token bucket, so parallel fetches don't get throttled by YouTrack.
+class TokenBucket:
+    def __init__(self, rate: float = RATE, capacity: int = BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Take a token if there is one, otherwise return seconds to wait before trying again.
+    def try_acquire(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    # Block until a token is available.
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    # Wait for a token without blocking the event loop.
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+# Seconds to wait according to the Retry-After header (either seconds or an HTTP date), or None.
+def retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Exponential backoff with full jitter.
+def backoff(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# requests.Session with default timeouts, retries of failed requests and a rate limit.
+class RetryingSession(requests.Session):
+    def __init__(self, timeout=TIMEOUT, retries: int = RETRIES, pool_size: int = POOL_SIZE,
+                 rate_limiter: TokenBucket = None):
+        super().__init__()
+        self.timeout = timeout
+        self.retries = retries
+        self.rate_limiter = TokenBucket() if rate_limiter is None else rate_limiter
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                delay = backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff(attempt)
+                response.close()
+
+            print(f"Retrying {method} {url} in {delay:.1f}s")
+            time.sleep(delay)
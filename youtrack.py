@@ -1,14 +1,50 @@
-﻿import os
+﻿import codecs
+import json
+import os
+import sys
+import time
 import requests
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Iterable, Callable, TypeVar
 
 from datetime import datetime
 
+import instrumentation
+from instrumentation import BYTES_RECEIVED, ISSUES_PARSED, in_current_context
+from issue_cache import IssueCache
+from transport import RetryingSession, TokenBucket
+
 YOUTRACK_URL = "https://youtrack.jetbrains.com/api"
 TOKEN = os.getenv("YOUTRACK_TOKEN")
 
 PRIORITY = "Priority"
 SUBSYSTEM = "Subsystem"
+TYPE = "Type"
+STATE = "State"
+BUG_PRIORITY = "Bug priority"
+
+PRIORITIES = ['Show-stopper', 'Critical', 'Major', 'Normal', 'Minor']
+TYPES = ['Bug', 'Performance Problem', 'Security Problem', 'Exception', 'Usability Problem', 'Cosmetics', 'Improvement', 'Task', 'Feature', 'Plan', ]
+BUG_TYPES = ["Bug", "Performance Problem", "Usability Problem", "Exception"]
+
+# Seconds to wait before asking again when YouTrack hasn't finished counting yet.
+COUNT_RETRY_DELAY = 0.5
+COUNT_RETRIES = 20
+
+# Number of issues requested per page ($top).
+PAGE_SIZE = 500
+
+# Bytes read from the response at once when streaming.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Upper bound for YouTrack queries running at the same time.
+MAX_WORKERS = 8
+
+BASE_FIELDS = ["idReadable", "summary"]
+CUSTOM_FIELDS_FIELD = "customFields(name,value(name))"
+COMMENT_FIELDS = "id,text,author(email),created"
+COMMENTS_FIELD = f"comments({COMMENT_FIELDS})"
+STAFF_EMAIL_DOMAIN = "@jetbrains.com"
 
 headers = {
     "Authorization": f"Bearer {TOKEN}",
@@ -16,203 +52,529 @@ headers = {
     "Content-Type": "application/json"
 }
 
+T = TypeVar("T")
+
+
+# Session for YouTrack API with timeouts, retries with backoff and a client-side rate limit.
+def create_session(rate_limiter: TokenBucket = None, session_class: Callable[..., RetryingSession] = RetryingSession) -> requests.Session:
+    client = session_class(rate_limiter=rate_limiter)
+    client.headers.update(headers)
+    return client
+
+
 class YouTrackIssue:
-    def __init__(self, id: str, summary: str, custom_fields: List[dict]):
+    # Issues are kept for whole release histories, so avoid a per-instance __dict__.
+    __slots__ = ("id", "summary", "type", "priority", "subsystem", "available_in", "state", "created", "resolved",
+                 "reporter", "comments")
+
+    def __init__(self, id: str, summary: str, type: str = None, priority: str = None, subsystem: str = None,
+                 available_in: str = None, state: str = None, created: int = None, resolved: int = None,
+                 reporter: str = None):
         self.id = id
         self.summary = summary
-        self.custom_fields = custom_fields
-        self.type = None
-        self.priority = None
-        self.subsystem = None
-        self.available_in = None
+        self.type = type
+        self.priority = priority
+        self.subsystem = subsystem
+        self.available_in = available_in
+        self.state = state
+        # Milliseconds since epoch
+        self.created = created
+        self.resolved = resolved
+        self.reporter = reporter
         self.comments = []
 
 
+# Decode elements of a top-level JSON array one by one from chunks of text.
+def iter_json_array(chunks: Iterator[str]) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+
+    for chunk in chunks:
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            # Skip whitespace and separators between elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("JSON array is expected")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element isn't complete yet, wait for the next chunk
+                break
+            position = end
+            yield element
+
+    raise ValueError("Unexpected end of JSON array")
+
+
+# Decode value of a single-value custom field (enum, state, ...).
+def decode_name(value) -> str:
+    return sys.intern(value['name'])
+
+# Decode value of a custom field which can hold one or several values (e.g. versions).
+def decode_names(value) -> str:
+    # If it's a list, join names of all values
+    if isinstance(value, list):
+        return sys.intern(', '.join([v['name'] for v in value if 'name' in v]))
+
+    # If it's a dictionary, extract the 'name'
+    if isinstance(value, dict) and 'name' in value:
+        return sys.intern(value['name'])
+
+    return None
+
+
+# Custom field name -> (YouTrackIssue attribute, value decoder).
+CUSTOM_FIELDS = {
+    "Type": ("type", decode_name),
+    "Priority": ("priority", decode_name),
+    "Subsystem": ("subsystem", decode_name),
+    "Available in": ("available_in", decode_names),
+    "State": ("state", decode_name),
+}
+
+# Count issues by several aggregations (see AGGREGATIONS) in one pass.
+def count_issues(issues: Iterable[YouTrackIssue], *aggregations: str) -> Dict[str, Dict[str, int]]:
+    specs = [(name, AGGREGATIONS[name]) for name in aggregations]
+    counts = {name: {} for name in aggregations}
+
+    for issue in issues:
+        for name, (attribute, predicate) in specs:
+            value = getattr(issue, attribute)
+            if value and (predicate is None or predicate(issue)):
+                counts[name][value] = counts[name].get(value, 0) + 1
+
+    return counts
+
+
+def print_counts(counts: Dict[str, int]):
+    print("__")
+
+    for type_name, count in counts.items():
+        print(f"{type_name}: {count}")
+
+
+# Builds the fields= and customFields= parameters, so YouTrack returns only what a report section needs.
+class Projection:
+    def __init__(self, custom_fields: Iterable[str] = (), fields: Iterable[str] = BASE_FIELDS):
+        # dict keeps the order and drops duplicates
+        self.fields = list(dict.fromkeys(fields))
+        self.custom_fields = list(dict.fromkeys(custom_fields))
+
+    # Add issue fields, e.g. "created", "resolved" or "reporter(login)".
+    def with_fields(self, *fields: str) -> "Projection":
+        return Projection(self.custom_fields, self.fields + list(fields))
+
+    # Add custom fields by name, e.g. "Priority".
+    def with_custom_fields(self, *custom_fields: str) -> "Projection":
+        return Projection(self.custom_fields + list(custom_fields), self.fields)
+
+    def merge(self, other: "Projection") -> "Projection":
+        return Projection(self.custom_fields + other.custom_fields, self.fields + other.fields)
+
+    def fields_param(self) -> str:
+        fields = self.fields + ([CUSTOM_FIELDS_FIELD] if self.custom_fields else [])
+        return ",".join(fields)
+
+    # Query parameters of /issues, also used as a part of the cache key.
+    def params(self) -> str:
+        return f"fields={self.fields_param()}" + "".join(
+            f"&customFields={requests.utils.quote(name)}" for name in self.custom_fields)
+
+    def __str__(self):
+        return self.params()
+
+
+# Get values of all fields from CUSTOM_FIELDS in one pass over Custom Fields.
+def extract_custom_fields(custom_fields: List[dict]) -> Dict[str, str]:
+    values = {}
+    for field in custom_fields:
+        spec = CUSTOM_FIELDS.get(field['name'])
+        if spec is None or field['value'] is None:
+            continue
+        attribute, decode = spec
+        if attribute not in values:
+            values[attribute] = decode(field['value'])
+    return values
+
+
+# Comments made by users, not by JetBrains staff.
+def is_user_email(email: str) -> bool:
+    return bool(email) and STAFF_EMAIL_DOMAIN not in email
+
+
+# Comment window in milliseconds since epoch (both ends included) and an author email predicate.
+# Checked on raw comments, so rejected comments are never converted.
+class CommentFilter:
+    def __init__(self, start: int = None, end: int = None, author: Callable[[str], bool] = None):
+        self.start = start
+        self.end = end
+        self.author = author
+
+    @classmethod
+    def between(cls, start: datetime, end: datetime, author: Callable[[str], bool] = None) -> "CommentFilter":
+        return cls(int(start.timestamp() * 1000), int(end.timestamp() * 1000), author)
+
+    def accepts(self, comment: dict) -> bool:
+        created = comment.get('created')
+        if self.start is not None and (created is None or created < self.start):
+            return False
+        if self.end is not None and (created is None or created > self.end):
+            return False
+        if self.author is not None:
+            return self.author(comment.get('author', {}).get('email', 'Unknown'))
+        return True
+
+
+def parse_comment(comment: dict) -> dict:
+    author_email = comment.get('author', {}).get('email', 'Unknown')  # Using 'fullName' for YouTrack's User type
+    return {
+        'id': comment['id'],
+        'text': comment['text'],
+        'author': author_email,
+        'created': comment['created']
+    }
+
+
+# Parse one issue from the YouTrack JSON payload. Raw custom fields are not kept on the issue.
+# Fields missing from the projection are left empty. Comments rejected by the filter are skipped.
+def parse_issue(issue_data: dict, comment_filter: CommentFilter = None) -> YouTrackIssue:
+    reporter = issue_data.get('reporter') or {}
+    issue = YouTrackIssue(issue_data['idReadable'], issue_data.get('summary'),
+                          created=issue_data.get('created'), resolved=issue_data.get('resolved'),
+                          reporter=reporter.get('login'),
+                          **extract_custom_fields(issue_data.get('customFields', [])))
+
+    # If comments exist, iterate over them
+    comments = issue_data.get('comments', [])
+    for comment in comments:
+        if comment_filter is not None and not comment_filter.accepts(comment):
+            continue
+        issue.comments.append(parse_comment(comment))
+
+    return issue
+
+
+def is_bug(issue: YouTrackIssue) -> bool:
+    return issue.type in BUG_TYPES
+
+
+# Aggregation name -> (issue attribute to group by, optional issue filter).
+AGGREGATIONS = {
+    PRIORITY: ("priority", None),
+    SUBSYSTEM: ("subsystem", None),
+    TYPE: ("type", None),
+    BUG_PRIORITY: ("priority", is_bug),
+}
+
+# Aggregation name -> (YouTrack field, known field values, optional sub-query filter) for server-side counting.
+COUNT_AGGREGATIONS = {
+    PRIORITY: (PRIORITY, PRIORITIES, None),
+    SUBSYSTEM: (SUBSYSTEM, None, None),
+    TYPE: (TYPE, TYPES, None),
+    BUG_PRIORITY: (PRIORITY, PRIORITIES, f"{TYPE}: " + ", ".join(f"{{{t}}}" for t in BUG_TYPES)),
+}
+
+
+# Only issue ids, e.g. to find out which issues still match a cached query.
+ID_PROJECTION = Projection(fields=["idReadable"])
+
+# Everything the parser understands. Report sections should ask for less.
+DEFAULT_PROJECTION = Projection(CUSTOM_FIELDS.keys(), BASE_FIELDS + ["created", "resolved", "reporter(login)"])
+
+
 class GetIssues:
-    def __init__(self, client: requests.Session, query: str = None):
+    def __init__(self, client: requests.Session, query: str = None, page_size: int = PAGE_SIZE, prefetch: bool = False,
+                 cache: IssueCache = None, stream: bool = False, projection: Projection = DEFAULT_PROJECTION):
         self.client = client
         self.query = query
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.cache = cache
+        # Decode issues one by one from the response instead of loading whole pages
+        self.stream = stream
+        self.projection = projection
+        self.issues = None
+        self.issues_with_comments = None
 
     # Get issue type from Custom Fields.
     def parse_issue_type(self, custom_fields: List[dict]) -> str:
-        for field in custom_fields:
-            if field['name'] == 'Type' and field['value'] is not None:
-                return field['value']['name']
-        return None
+        return extract_custom_fields(custom_fields).get("type")
 
     # Get issue priority from Custom Fields.
     def parse_issue_priority(self, custom_fields: List[dict]) -> str:
-        for field in custom_fields:
-            if field['name'] == 'Priority' and field['value'] is not None:
-                return field['value']['name']
-        return None
+        return extract_custom_fields(custom_fields).get("priority")
 
     # Get issue subsystem from Custom Fields.
     def parse_issue_subystem(self, custom_fields: List[dict]) -> str:
-        for field in custom_fields:
-            if field['name'] == 'Subsystem' and field['value'] is not None:
-                return field['value']['name']
-        return None
+        return extract_custom_fields(custom_fields).get("subsystem")
 
-    # Get issue subsystem from Custom Fields.
+    # Get issue "Available in" versions from Custom Fields.
     def parse_issue_Avaiable_in(self, custom_fields: List[dict]) -> str:
-        for field in custom_fields:
-            if field['name'] == 'Available in':
-                value = field['value']
-
-                # Check if the value is None
-                if value is None:
-                    return None
-
-                # If it's a list, extract values from the list
-                if isinstance(value, list):
-                    # Assuming you want to join multiple values in the list
-                    return ', '.join([v['name'] for v in value if 'name' in v])
-
-                # If it's a dictionary, extract the 'name'
-                if isinstance(value, dict) and 'name' in value:
-                    return value['name']
-
-        return None  # Return None if 'Available in' is not found
-
-    # Get list of YouTrack issues.
-    def get_issues(self) -> List[YouTrackIssue]:
-        api_query = f"{YOUTRACK_URL}/issues?fields=idReadable,summary,customFields(name,value(name))&query={requests.utils.quote(self.query)}"
-        response = self.client.get(api_query)
-        response.raise_for_status()
-
-        data = response.json()
-        youtrack_issues = [YouTrackIssue(issue['idReadable'], issue['summary'], issue['customFields']) for issue in data]
+        return extract_custom_fields(custom_fields).get("available_in")
 
-        for issue in youtrack_issues:
-            issue.id = issue.id
-            issue.summary = issue.summary
-            issue.type = self.parse_issue_type(issue.custom_fields)
-            issue.priority = self.parse_issue_priority(issue.custom_fields)
-            issue.subsystem = self.parse_issue_subystem(issue.custom_fields)
-            issue.available_in = self.parse_issue_Avaiable_in(issue.custom_fields)
+    # Parse one issue from the YouTrack JSON payload.
+    def parse_issue(self, issue_data: dict, comment_filter: CommentFilter = None) -> YouTrackIssue:
+        return parse_issue(issue_data, comment_filter)
 
-        return youtrack_issues
+    def page_url(self, fields: str, skip: int, query: str = None) -> str:
+        query = self.query if query is None else query
+        return f"{YOUTRACK_URL}/issues?{fields}&query={requests.utils.quote(query)}&$skip={skip}&$top={self.page_size}"
 
-    def get_issues_with_comments(self) -> List[YouTrackIssue]:
-        api_query = f"{YOUTRACK_URL}/issues?fields=idReadable,summary,comments(id,text,author(email),created),customFields(name,value(name))&query={requests.utils.quote(self.query)}"
-        response = self.client.get(api_query)
+    # Get one page of raw issues using $skip/$top.
+    def fetch_page(self, fields: str, skip: int, query: str = None) -> List[dict]:
+        response = self.client.get(self.page_url(fields, skip, query))
         response.raise_for_status()
-
-        data = response.json()
-        youtrack_issues = [YouTrackIssue(issue['idReadable'], issue['summary'], issue['customFields']) for issue in data]
-
-        for issue, issue_data in zip(youtrack_issues, data):
-            issue.id = issue.id
-            issue.type = self.parse_issue_type(issue.custom_fields)
-            issue.priority = self.parse_issue_priority(issue.custom_fields)
-            issue.subsystem = self.parse_issue_subystem(issue.custom_fields)
-            issue.available_in = self.parse_issue_Avaiable_in(issue.custom_fields)
-
-            # If comments exist, iterate over them
-            comments = issue_data.get('comments', [])
-            for comment in comments:
-                # # Convert the 'created' timestamp to a datetime object for comparison
-                # created_date = datetime.fromtimestamp(comment['created'] / 1000)  # Assuming timestamp is in milliseconds
-
-                author_email = comment.get('author', {}).get('email', 'Unknown')  # Using 'fullName' for YouTrack's User type
-
-                issue.comments.append({
-                    'id': comment['id'],
-                    'text': comment['text'],
-                    'author': author_email,
-                    'created': comment['created'] # Optional: format the datetime
-                })
-
-        return youtrack_issues
-
+        instrumentation.add(**{BYTES_RECEIVED: len(response.content)})
+        return response.json()
+
+    # Decode one page of raw issues from the response byte stream without loading the whole response.
+    def stream_page(self, fields: str, skip: int, query: str = None) -> Iterator[dict]:
+        with self.client.get(self.page_url(fields, skip, query), stream=True) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            chunks = (decoder.decode(chunk) for chunk in self.count_bytes(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+            yield from iter_json_array(chunks)
+
+    @staticmethod
+    def count_bytes(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            instrumentation.add(**{BYTES_RECEIVED: len(chunk)})
+            yield chunk
+
+    # Yield raw pages until YouTrack returns a short page.
+    # With prefetch enabled the next page is requested while the current one is being consumed.
+    def fetch_pages(self, fields: str, query: str = None) -> Iterator[List[dict]]:
+        skip = 0
+        if not self.prefetch:
+            while True:
+                page = self.fetch_page(fields, skip, query)
+                if page:
+                    yield page
+                if len(page) < self.page_size:
+                    return
+                skip += self.page_size
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            fetch_page = in_current_context(self.fetch_page)
+            future = executor.submit(fetch_page, fields, skip, query)
+            while True:
+                page = future.result()
+                last_page = len(page) < self.page_size
+                if not last_page:
+                    skip += self.page_size
+                    future = executor.submit(fetch_page, fields, skip, query)
+                if page:
+                    yield page
+                if last_page:
+                    return
+
+    # Yield raw issues of all pages. In stream mode only one issue at a time is decoded.
+    def fetch_issue_data(self, fields: str, query: str = None) -> Iterator[dict]:
+        if not self.stream:
+            for page in self.fetch_pages(fields, query):
+                yield from page
+            return
+
+        skip = 0
+        while True:
+            count = 0
+            for issue_data in self.stream_page(fields, skip, query):
+                count += 1
+                yield issue_data
+            if count < self.page_size:
+                return
+            skip += self.page_size
+
+    # Get raw issues through the cache. Only issues updated since the last sync are requested for a stale entry.
+    def fetch_cached(self, fields: str) -> Iterator[dict]:
+        entry = self.cache.get(self.query, fields)
+        if entry is None:
+            yield from self.cache.store(self.query, fields, self.fetch_issue_data(fields))
+            return
+
+        if not entry.is_fresh():
+            refresh_query = self.cache.refresh_query(self.query, entry)
+            # Issues which stopped matching the query (e.g. reopened ones) or were deleted are only noticed
+            # by their absence, so ids of all matching issues are fetched too
+            ids = {issue_data['idReadable'] for issue_data in self.fetch_issue_data(ID_PROJECTION.params())}
+            self.cache.update(self.query, fields, entry, self.fetch_issue_data(fields, refresh_query), ids)
+
+        yield from self.cache.iter_issues(self.query, fields)
+
+    # Stream YouTrack issues page by page.
+    def iter_issues(self, projection: Projection = None, comment_filter: CommentFilter = None) -> Iterator[YouTrackIssue]:
+        fields = (self.projection if projection is None else projection).params()
+        issues_data = self.fetch_issue_data(fields) if self.cache is None else self.fetch_cached(fields)
+        issues = (self.parse_issue(issue_data, comment_filter) for issue_data in issues_data)
+        return instrumentation.iterate(issues, "get_issues", "youtrack", counter=ISSUES_PARSED, query=self.query)
+
+    # Get list of YouTrack issues. The list is fetched once and reused by all aggregations.
+    def get_issues(self) -> List[YouTrackIssue]:
+        if self.issues is None:
+            self.issues = list(self.iter_issues())
+        return self.issues
+
+    # Stream issues with their comments. Only comments accepted by the filter are kept.
+    def iter_issues_with_comments(self, comment_filter: CommentFilter = None) -> Iterator[YouTrackIssue]:
+        return self.iter_issues(self.projection.with_fields(COMMENTS_FIELD), comment_filter)
+
+    # Filtered comments depend on the filter, so only the unfiltered list is memoized.
+    def get_issues_with_comments(self, comment_filter: CommentFilter = None) -> List[YouTrackIssue]:
+        if comment_filter is not None:
+            return list(self.iter_issues_with_comments(comment_filter))
+        if self.issues_with_comments is None:
+            self.issues_with_comments = list(self.iter_issues_with_comments())
+        return self.issues_with_comments
+
+    # Get comments of one issue from its activities. YouTrack only returns comments added within the window,
+    # so comments outside of it are never downloaded. The author predicate is checked locally.
+    def fetch_issue_comments(self, issue_id: str, comment_filter: CommentFilter) -> List[dict]:
+        window = "".join(f"&{name}={value}" for name, value in (("start", comment_filter.start), ("end", comment_filter.end))
+                         if value is not None)
+        comments = []
+        skip = 0
+        while True:
+            url = (f"{YOUTRACK_URL}/issues/{issue_id}/activities?categories=CommentsCategory{window}"
+                   f"&fields=added({COMMENT_FIELDS})&$skip={skip}&$top={self.page_size}")
+            response = self.client.get(url)
+            response.raise_for_status()
+            instrumentation.add(**{BYTES_RECEIVED: len(response.content)})
+            activities = response.json()
+            for activity in activities:
+                # Removed comments come as activities without added comments
+                comments.extend(comment for comment in activity.get('added') or []
+                                if isinstance(comment, dict) and comment_filter.accepts(comment))
+            if len(activities) < self.page_size:
+                return comments
+            skip += self.page_size
+
+    # Stream issues with comments requested per issue with a server-side window.
+    # Only the issue projection is fetched for the issue list, comments of several issues are requested in parallel.
+    def iter_issues_with_windowed_comments(self, comment_filter: CommentFilter,
+                                           max_workers: int = MAX_WORKERS) -> Iterator[YouTrackIssue]:
+        issues = list(self.iter_issues())
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetch_issue_comments = in_current_context(self.fetch_issue_comments)
+            all_comments = executor.map(lambda issue: fetch_issue_comments(issue.id, comment_filter), issues)
+            for issue, comments in zip(issues, all_comments):
+                issue.comments = [parse_comment(comment) for comment in comments]
+                yield issue
+
+
+    # Count issues by several aggregations (see AGGREGATIONS) in one pass over the fetched issues.
+    def count_issues_by(self, *aggregations: str) -> Dict[str, Dict[str, int]]:
+        return count_issues(self.get_issues(), *aggregations)
 
     #Dict[str, Dict[str, int]]
     def get_issues_by(self) -> Dict[str, Dict[str, int]]:
-        youtrack_issues = self.get_issues()
-
-        issue_priority_counts = {}
-        issue_subsystem_counts = {}
-
-        for issue in youtrack_issues:
-            if issue.priority:
-                if issue.priority in issue_priority_counts:
-                    issue_priority_counts[issue.priority] += 1
-                else:
-                    issue_priority_counts[issue.priority] = 1
-            if issue.subsystem:
-                if issue.subsystem in issue_subsystem_counts:
-                    issue_subsystem_counts[issue.subsystem] += 1
-                else:
-                    issue_subsystem_counts[issue.subsystem] = 1
+        counts = self.count_issues_by(PRIORITY, SUBSYSTEM)
 
-        print("__")
+        print_counts(counts[PRIORITY])
+        print_counts(counts[SUBSYSTEM])
 
-        for type_name, count in issue_priority_counts.items():
-            print(f"{type_name}: {count}")
-
-        print("__")
-        for type_name, count in issue_subsystem_counts.items():
-            print(f"{type_name}: {count}")
-
-        return { f"{PRIORITY}": issue_priority_counts,
-                 f"{SUBSYSTEM}": issue_subsystem_counts}
+        return counts
 
     def get_all_issues_by_priority(self) -> Dict[str, int]:
-        youtrack_issues = self.get_issues()
-
-        issue_priority_counts = {}
-
-        for issue in youtrack_issues:
-            if issue.priority:
-                if issue.priority in issue_priority_counts:
-                    issue_priority_counts[issue.priority] += 1
-                else:
-                    issue_priority_counts[issue.priority] = 1
-
-        print("__")
-
-        for type_name, count in issue_priority_counts.items():
-            print(f"{type_name}: {count}")
-
+        issue_priority_counts = self.count_issues_by(PRIORITY)[PRIORITY]
+        print_counts(issue_priority_counts)
         return issue_priority_counts
 
-
     def get_bugs_by_priority(self) -> Dict[str, int]:
-        youtrack_issues = self.get_issues()
-
-        issue_priority_counts = {}
-
-        for issue in youtrack_issues:
-            if (issue.type == "Bug" or issue.type == "Performance Problem" or issue.type == "Usability Problem" or issue.type == "Exception") and issue.priority:
-                if issue.priority in issue_priority_counts:
-                    issue_priority_counts[issue.priority] += 1
-                else:
-                    issue_priority_counts[issue.priority] = 1
-
-        print("__")
-
-        for type_name, count in issue_priority_counts.items():
-            print(f"{type_name}: {count}")
-
+        issue_priority_counts = self.count_issues_by(BUG_PRIORITY)[BUG_PRIORITY]
+        print_counts(issue_priority_counts)
         return issue_priority_counts
 
     def get_issues_by_type(self) -> Dict[str, int]:
-        youtrack_issues = self.get_issues()
-
-        issue_type_counts = {}
-
-        for issue in youtrack_issues:
-            if issue.type:
-                if issue.type in issue_type_counts:
-                    issue_type_counts[issue.type] += 1
-                else:
-                    issue_type_counts[issue.type] = 1
-
-        print("__")
-
-        for type_name, count in issue_type_counts.items():
-            print(f"{type_name}: {count}")
-
+        issue_type_counts = self.count_issues_by(TYPE)[TYPE]
+        print_counts(issue_type_counts)
         return issue_type_counts
 
+
+# Counts issues on the YouTrack side instead of downloading them.
+# Every value of an aggregated field is counted with its own sub-query, e.g. "(query) and Priority: {Major}".
+# Aggregations over fields without a known set of values (e.g. Subsystem) fall back to downloading issues.
+class CountIssues(GetIssues):
+    def __init__(self, client: requests.Session, query: str = None, page_size: int = PAGE_SIZE, prefetch: bool = False,
+                 cache: IssueCache = None, stream: bool = False, projection: Projection = DEFAULT_PROJECTION,
+                 values: Dict[str, List[str]] = None, max_workers: int = MAX_WORKERS):
+        super().__init__(client, query, page_size, prefetch, cache, stream, projection)
+        # Field name -> values to count, overrides values from COUNT_AGGREGATIONS
+        self.values = values or {}
+        self.max_workers = max_workers
+        # Sub-query -> count, so aggregations shared by several sections are counted once
+        self.counts: Dict[str, int] = {}
+
+    # Get number of issues matching the query.
+    def count(self, query: str) -> int:
+        if query not in self.counts:
+            self.counts[query] = self.count_on_server(query)
+        return self.counts[query]
+
+    def count_on_server(self, query: str) -> int:
+        for _ in range(COUNT_RETRIES):
+            response = self.client.post(f"{YOUTRACK_URL}/issuesGetter/count?fields=count", json={"query": query})
+            response.raise_for_status()
+            instrumentation.add(**{BYTES_RECEIVED: len(response.content)})
+            count = response.json()['count']
+            # -1 means that YouTrack is still counting
+            if count >= 0:
+                return count
+            time.sleep(COUNT_RETRY_DELAY)
+        raise TimeoutError(f"YouTrack didn't count issues for query: {query}")
+
+    def count_issues_by(self, *aggregations: str) -> Dict[str, Dict[str, int]]:
+        with instrumentation.span("count_issues", "youtrack", query=self.query):
+            return self.count_values(*aggregations)
+
+    def count_values(self, *aggregations: str) -> Dict[str, Dict[str, int]]:
+        sub_queries = {}
+        fallback = []
+        for name in aggregations:
+            field, values, condition = COUNT_AGGREGATIONS[name]
+            values = self.values.get(field, values)
+            if values is None:
+                fallback.append(name)
+                continue
+            for value in values:
+                sub_query = f"({self.query}) and {field}: {{{value}}}"
+                if condition:
+                    sub_query += f" and {condition}"
+                sub_queries[(name, value)] = sub_query
+
+        counts = {name: {} for name in aggregations}
+        if sub_queries:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(sub_queries)))) as executor:
+                count = in_current_context(self.count)
+                futures = {key: executor.submit(count, sub_query) for key, sub_query in sub_queries.items()}
+                for (name, value), future in futures.items():
+                    value_count = future.result()
+                    # Keep the shape of GetIssues results where missing values aren't listed
+                    if value_count:
+                        counts[name][value] = value_count
+
+        if fallback:
+            counts.update(super().count_issues_by(*fallback))
+
+        return counts
+
+
+# Apply `fetch` to several handlers concurrently and return results keyed by the same labels as `handlers`.
+def fetch_concurrently(handlers: Dict[str, GetIssues], fetch: Callable[[GetIssues], T],
+                       max_workers: int = MAX_WORKERS) -> Dict[str, T]:
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(handlers)))) as executor:
+        fetch = in_current_context(fetch)
+        futures = {label: executor.submit(fetch, handler) for label, handler in handlers.items()}
+        return {label: future.result() for label, future in futures.items()}
@@ -0,0 +1,144 @@
+﻿import asyncio
+from typing import List, Dict, Callable, Awaitable, TypeVar
+from urllib.parse import quote
+
+import aiohttp
+from yarl import URL
+
+import youtrack
+from transport import RETRY_STATUSES, RETRIES, POOL_SIZE, TokenBucket, backoff, retry_after
+from youtrack import (YouTrackIssue, Projection, DEFAULT_PROJECTION, COMMENTS_FIELD, PAGE_SIZE, PRIORITY, SUBSYSTEM,
+                      TYPE, BUG_PRIORITY, COUNT_RETRIES, COUNT_RETRY_DELAY, count_issues, parse_issue,
+                      print_counts)
+
+T = TypeVar("T")
+
+# Upper bound for requests running at the same time on one event loop.
+MAX_CONCURRENCY = 16
+
+TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=120)
+
+
+def create_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(headers=youtrack.headers, timeout=TIMEOUT,
+                                 connector=aiohttp.TCPConnector(limit=POOL_SIZE))
+
+
+# Sends requests with bounded concurrency, a client-side rate limit and retries with backoff.
+class AsyncTransport:
+    def __init__(self, session: aiohttp.ClientSession, max_concurrency: int = MAX_CONCURRENCY,
+                 rate_limiter: TokenBucket = None, retries: int = RETRIES):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenBucket() if rate_limiter is None else rate_limiter
+        self.retries = retries
+
+    async def request_json(self, method: str, url: str, **kwargs):
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                last_attempt = attempt == self.retries
+                await self.rate_limiter.acquire_async()
+                try:
+                    async with self.session.request(method, url, **kwargs) as response:
+                        if response.status not in RETRY_STATUSES or last_attempt:
+                            response.raise_for_status()
+                            return await response.json()
+                        delay = retry_after(response)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if last_attempt:
+                        raise
+                    delay = None
+
+                if delay is None:
+                    delay = backoff(attempt)
+                print(f"Retrying {method} {url} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+# Async counterpart of youtrack.GetIssues with the same parsing and aggregations.
+# Pages of one query are requested concurrently once the number of issues is known.
+class AsyncGetIssues:
+    def __init__(self, transport: AsyncTransport, query: str = None, page_size: int = PAGE_SIZE,
+                 projection: Projection = DEFAULT_PROJECTION):
+        self.transport = transport
+        self.query = query
+        self.page_size = page_size
+        self.projection = projection
+        self.issues = None
+        self.issues_with_comments = None
+
+    # Get number of issues matching the query.
+    async def count(self, query: str = None) -> int:
+        query = self.query if query is None else query
+        for _ in range(COUNT_RETRIES):
+            data = await self.transport.request_json("POST", f"{youtrack.YOUTRACK_URL}/issuesGetter/count?fields=count",
+                                                     json={"query": query})
+            # -1 means that YouTrack is still counting
+            if data['count'] >= 0:
+                return data['count']
+            await asyncio.sleep(COUNT_RETRY_DELAY)
+        raise TimeoutError(f"YouTrack didn't count issues for query: {query}")
+
+    async def fetch_page(self, fields: str, skip: int) -> List[dict]:
+        # The URL is already encoded, so aiohttp must not encode it again
+        url = URL(f"{youtrack.YOUTRACK_URL}/issues?{fields}&query={quote(self.query)}&$skip={skip}&$top={self.page_size}",
+                  encoded=True)
+        return await self.transport.request_json("GET", url)
+
+    async def fetch_issues(self, projection: Projection) -> List[YouTrackIssue]:
+        fields = projection.params()
+        total = await self.count()
+        pages = list(await asyncio.gather(*[self.fetch_page(fields, skip) for skip in range(0, total, self.page_size)]))
+
+        # Issues created after counting shift the pages, fetch the rest sequentially
+        while pages and len(pages[-1]) == self.page_size:
+            pages.append(await self.fetch_page(fields, len(pages) * self.page_size))
+
+        # Shifted pages can also overlap
+        issues_data = {issue_data['idReadable']: issue_data for page in pages for issue_data in page}
+        return [parse_issue(issue_data) for issue_data in issues_data.values()]
+
+    async def get_issues(self) -> List[YouTrackIssue]:
+        if self.issues is None:
+            self.issues = await self.fetch_issues(self.projection)
+        return self.issues
+
+    async def get_issues_with_comments(self) -> List[YouTrackIssue]:
+        if self.issues_with_comments is None:
+            self.issues_with_comments = await self.fetch_issues(self.projection.with_fields(COMMENTS_FIELD))
+        return self.issues_with_comments
+
+    async def count_issues_by(self, *aggregations: str) -> Dict[str, Dict[str, int]]:
+        return count_issues(await self.get_issues(), *aggregations)
+
+    async def get_issues_by(self) -> Dict[str, Dict[str, int]]:
+        counts = await self.count_issues_by(PRIORITY, SUBSYSTEM)
+
+        print_counts(counts[PRIORITY])
+        print_counts(counts[SUBSYSTEM])
+
+        return counts
+
+    async def get_all_issues_by_priority(self) -> Dict[str, int]:
+        issue_priority_counts = (await self.count_issues_by(PRIORITY))[PRIORITY]
+        print_counts(issue_priority_counts)
+        return issue_priority_counts
+
+    async def get_bugs_by_priority(self) -> Dict[str, int]:
+        issue_priority_counts = (await self.count_issues_by(BUG_PRIORITY))[BUG_PRIORITY]
+        print_counts(issue_priority_counts)
+        return issue_priority_counts
+
+    async def get_issues_by_type(self) -> Dict[str, int]:
+        issue_type_counts = (await self.count_issues_by(TYPE))[TYPE]
+        print_counts(issue_type_counts)
+        return issue_type_counts
+
+
+# Run independent queries concurrently on one event loop and return results keyed by the same labels as `queries`.
+async def run_queries(transport: AsyncTransport, queries: Dict[str, str],
+                      fetch: Callable[[AsyncGetIssues], Awaitable[T]],
+                      projection: Projection = DEFAULT_PROJECTION) -> Dict[str, T]:
+    results = await asyncio.gather(*[fetch(AsyncGetIssues(transport, query, projection=projection))
+                                     for query in queries.values()])
+    return dict(zip(queries.keys(), results))
@@ -0,0 +1,439 @@
+﻿import fnmatch
+import gzip
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Iterator, Optional
+from urllib.parse import urlsplit, parse_qs
+
+from transport import RetryingSession
+
+FIXTURES_FILE = os.path.join("reports", "fixtures", "youtrack.jsonl.gz")
+
+SYNTHETIC_PROJECT = "ReSharper"
+SYNTHETIC_START = datetime(2023, 1, 1)
+SYNTHETIC_DAYS = 730
+
+SYNTHETIC_PRIORITIES = [('Show-stopper', 1), ('Critical', 4), ('Major', 25), ('Normal', 60), ('Minor', 10)]
+SYNTHETIC_TYPES = [('Bug', 55), ('Performance Problem', 5), ('Security Problem', 1), ('Exception', 15),
+                   ('Usability Problem', 4), ('Cosmetics', 3), ('Improvement', 8), ('Task', 4), ('Feature', 4), ('Plan', 1)]
+SYNTHETIC_STATES = [('Submitted', 20), ('Open', 25), ('In Progress', 5), ('Fixed', 30), ('Verified', 10), ('Duplicate', 10)]
+SYNTHETIC_SUBSYSTEMS = ['Code Analysis', 'Code Completion', 'Refactorings', 'Navigation', 'Unit Testing', 'Formatter',
+                        'Razor', 'Blazor', 'C++', 'Debugger', 'Solution Builder', 'Settings', 'Installer', 'Performance',
+                        'Quick Fixes', 'Find Usages', 'Code Cleanup', 'Inlay Hints', 'Decompiler', 'NuGet']
+SYNTHETIC_VERSIONS = ['2023.1', '2023.1.1', '2023.2', '2023.2.1', '2023.3', '2023.3.1', '2024.1', '2024.1.1', '2024.2',
+                      '2024.2.1', '2024.2.2', '2024.2.3', '2024.3']
+STAFF_SHARE = 0.4
+
+GROUPS = {
+    "jetbrains-team": lambda login: login.startswith("jb-") or login == "dotnet-support",
+    "dotnet-support": lambda login: login == "dotnet-support",
+}
+
+
+def to_millis(date: datetime) -> int:
+    return int(date.timestamp() * 1000)
+
+
+# Recording
+
+# Session which saves every request/response pair to a compressed JSON lines fixture file.
+class RecordingSession(RetryingSession):
+    def __init__(self, path: str = FIXTURES_FILE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def request(self, method, url, *args, **kwargs):
+        response = super().request(method, url, *args, **kwargs)
+        if response.ok:
+            parts = urlsplit(response.url)
+            record = {
+                "method": method.upper(),
+                "path": parts.path,
+                "params": parse_qs(parts.query),
+                "body": kwargs.get("json"),
+                # Reading the content keeps it available for iter_content() of streaming callers
+                "response": json.loads(response.content),
+            }
+            with self.lock, gzip.open(self.path, "at", encoding="utf-8") as fixtures:
+                fixtures.write(json.dumps(record) + "\n")
+        return response
+
+
+def load_fixtures(path: str = FIXTURES_FILE) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as fixtures:
+        for line in fixtures:
+            yield json.loads(line)
+
+
+# Data sources of the stand-in server
+
+# Recorded responses. Pages of the same query and fields are joined, so they can be served with any $skip/$top.
+class FixtureStore:
+    def __init__(self, records: Iterator[dict]):
+        self.issues: Dict[tuple, Dict[str, dict]] = {}
+        self.counts: Dict[str, int] = {}
+        # Other GET requests are replayed only with exactly the same parameters
+        self.responses: Dict[tuple, list] = {}
+        pages = []
+        for record in records:
+            params = record["params"]
+            if record["path"].endswith("/issuesGetter/count"):
+                self.counts[record["body"]["query"]] = record["response"]["count"]
+            elif record["path"].endswith("/issues"):
+                pages.append((int(params.get("$skip", ["0"])[0]), record))
+            elif record["method"] == "GET":
+                self.responses[response_key(record["path"], params)] = record["response"]
+
+        for _, record in sorted(pages, key=lambda page: page[0]):
+            params = record["params"]
+            key = (first(params, "query"), first(params, "fields"), tuple(params.get("customFields", [])))
+            issues = self.issues.setdefault(key, {})
+            for issue in record["response"]:
+                issues[issue["idReadable"]] = issue
+
+    def find(self, query: str, fields: str, custom_fields: List[str]) -> List[dict]:
+        issues = self.issues.get((query, fields, tuple(custom_fields)))
+        if issues is None:
+            raise KeyError(f"No recorded issues for query: {query}")
+        return list(issues.values())
+
+    def count(self, query: str) -> int:
+        if query in self.counts:
+            return self.counts[query]
+        for (recorded_query, _, _), issues in self.issues.items():
+            if recorded_query == query:
+                return len(issues)
+        raise KeyError(f"No recorded count for query: {query}")
+
+    def comment_activities(self, path: str, params: Dict[str, List[str]]) -> List[dict]:
+        key = response_key(path, params)
+        if key not in self.responses:
+            raise KeyError(f"No recorded response for {path}")
+        return self.responses[key]
+
+
+def response_key(path: str, params: Dict[str, List[str]]) -> tuple:
+    return path.rstrip("/"), json.dumps(params, sort_keys=True)
+
+
+# Synthetic issues with realistic custom fields and comments. The same seed always gives the same issues.
+def generate_issues(count: int, seed: int = 0, comments_per_issue: int = 3) -> List[dict]:
+    return list(iter_generated_issues(count, seed, comments_per_issue))
+
+
+# Generate synthetic issues one by one, so large corpora don't have to be kept in memory.
+def iter_generated_issues(count: int, seed: int = 0, comments_per_issue: int = 3) -> Iterator[dict]:
+    rng = random.Random(seed)
+    reporters = [f"jb-dev{i}" for i in range(50)] + ["dotnet-support"] + [f"user{i}" for i in range(500)]
+    staff = reporters[:51]
+    users = reporters[51:]
+
+    def weighted(values):
+        names, weights = zip(*values)
+        return rng.choices(names, weights)[0]
+
+    for n in range(count):
+        created = SYNTHETIC_START + timedelta(seconds=rng.randrange(SYNTHETIC_DAYS * 24 * 3600))
+        state = weighted(SYNTHETIC_STATES)
+        resolved = created + timedelta(days=rng.randrange(1, 90)) if state in ('Fixed', 'Verified', 'Duplicate') else None
+        reporter = rng.choice(staff) if rng.random() < STAFF_SHARE else rng.choice(users)
+        available_in = [{"name": version} for version in rng.sample(SYNTHETIC_VERSIONS, rng.randrange(0, 3))] if resolved else []
+
+        comments = []
+        for c in range(rng.randrange(comments_per_issue * 2 + 1)):
+            author = rng.choice(staff) if rng.random() < 0.7 else rng.choice(users)
+            domain = "jetbrains.com" if author in staff else "example.com"
+            comments.append({
+                "id": f"{n}-{c}",
+                "text": f"Comment {c} on issue {n}. " + " ".join(rng.choice(["works", "broken", "again", "thanks", "slow", "crash", "please", "fix"]) for _ in range(rng.randrange(5, 40))),
+                "author": {"email": f"{author}@{domain}"},
+                "created": to_millis(created + timedelta(hours=rng.randrange(1, 24 * 120))),
+            })
+
+        yield {
+            "idReadable": f"RSRP-{n + 1}",
+            "summary": f"Synthetic issue {n + 1}",
+            "created": to_millis(created),
+            "updated": to_millis(resolved or created),
+            "resolved": to_millis(resolved) if resolved else None,
+            "reporter": {"login": reporter},
+            "customFields": [
+                {"name": "Type", "value": {"name": weighted(SYNTHETIC_TYPES)}},
+                {"name": "Priority", "value": {"name": weighted(SYNTHETIC_PRIORITIES)}},
+                {"name": "Subsystem", "value": {"name": rng.choice(SYNTHETIC_SUBSYSTEMS)} if rng.random() < 0.9 else None},
+                {"name": "State", "value": {"name": state}},
+                {"name": "Available in", "value": available_in},
+            ],
+            "comments": comments,
+        }
+
+
+# Synthetic issues filtered by a subset of the YouTrack query language used by the report.
+class SyntheticStore:
+    def __init__(self, issues: List[dict]):
+        self.issues = issues
+        self.by_id = None
+
+    def find(self, query: str, fields: str, custom_fields: List[str]) -> List[dict]:
+        return [issue for issue in self.issues if matches(issue, query)]
+
+    def count(self, query: str) -> int:
+        return sum(1 for issue in self.issues if matches(issue, query))
+
+    # Comment activities of one issue within the start/end window (milliseconds, both included).
+    def comment_activities(self, path: str, params: Dict[str, List[str]]) -> List[dict]:
+        if self.by_id is None:
+            self.by_id = {issue["idReadable"]: issue for issue in self.issues}
+        issue = self.by_id.get(path.rstrip("/").split("/")[-2])
+        if issue is None:
+            raise KeyError(f"No issue for {path}")
+
+        start = int(first(params, "start", "0"))
+        end = int(first(params, "end", str(2 ** 63)))
+        skip = int(first(params, "$skip", "0"))
+        top = int(first(params, "$top", "-1"))
+        activities = [{"added": [comment]} for comment in issue.get("comments", []) if start <= comment["created"] <= end]
+        activities = activities[skip:] if top < 0 else activities[skip:skip + top]
+        return project(activities, parse_fields(first(params, "fields", "added(id)")))
+
+
+# Query evaluation: "and"/"or", parentheses, "field: value, {other value}", "-value", date ranges and #resolved.
+# Unknown attributes are ignored, so they don't filter anything out.
+
+def first(params: Dict[str, List[str]], name: str, default: str = None) -> Optional[str]:
+    values = params.get(name)
+    return values[0] if values else default
+
+
+def split_top_level(text: str, separator: str) -> List[str]:
+    parts = []
+    depth = 0
+    start = 0
+    lower = text.lower()
+    i = 0
+    while i < len(text):
+        if text[i] in "({":
+            depth += 1
+        elif text[i] in ")}":
+            depth -= 1
+        elif depth == 0 and lower.startswith(separator, i):
+            parts.append(text[start:i])
+            i += len(separator)
+            start = i
+            continue
+        i += 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def matches(issue: dict, query: str) -> bool:
+    alternatives = split_top_level(query, " or ")
+    if len(alternatives) > 1:
+        return any(matches(issue, alternative) for alternative in alternatives)
+    return all(matches_clause(issue, clause) for clause in split_top_level(query, " and "))
+
+
+def matches_clause(issue: dict, clause: str) -> bool:
+    if clause.startswith("(") and clause.endswith(")"):
+        return matches(issue, clause[1:-1])
+    if clause.lower() == "#resolved":
+        return issue.get("resolved") is not None
+    if clause.lower() == "#unresolved":
+        return issue.get("resolved") is None
+    if ":" not in clause:
+        return True
+
+    attribute, value = [part.strip() for part in clause.split(":", 1)]
+    attribute = attribute.lower()
+    values = [value.strip().strip("{}") for value in split_top_level(value, ",")]
+
+    if attribute in ("created", "updated", "resolved"):
+        return in_dates(issue.get(attribute), values[0])
+    if attribute == "commented":
+        return any(in_dates(comment["created"], values[0]) for comment in issue.get("comments", []))
+    if attribute == "project":
+        return any(value.lower() == SYNTHETIC_PROJECT.lower() for value in values)
+    if attribute == "created by":
+        login = (issue.get("reporter") or {}).get("login", "")
+        return matches_values(values, lambda value: GROUPS.get(value, lambda l: l == value)(login))
+
+    names = custom_field_values(issue, attribute)
+    if names is None:
+        return True
+    return matches_values(values, lambda value: any(fnmatch.fnmatch(name.lower(), value.lower()) for name in names))
+
+
+# Positive values are alternatives, negative values (-value) must all not match.
+def matches_values(values: List[str], check) -> bool:
+    positive = [value for value in values if not value.startswith("-")]
+    negative = [value[1:] for value in values if value.startswith("-")]
+    if any(check(value) for value in negative):
+        return False
+    return not positive or any(check(value) for value in positive)
+
+
+def custom_field_values(issue: dict, name: str) -> Optional[List[str]]:
+    for field in issue.get("customFields", []):
+        if field["name"].lower() == name:
+            value = field["value"]
+            if value is None:
+                return []
+            if isinstance(value, list):
+                return [v["name"] for v in value]
+            return [value["name"]]
+    return None
+
+
+def in_dates(millis: Optional[int], dates: str) -> bool:
+    if millis is None:
+        return False
+    if ".." not in dates:
+        start = end = dates.strip()
+    else:
+        start, end = [part.strip() for part in dates.split("..")]
+    start_date = datetime.strptime(start, "%Y-%m-%d")
+    end_date = datetime.now() if end.lower() == "today" else datetime.strptime(end, "%Y-%m-%d")
+    return to_millis(start_date) <= millis < to_millis(end_date + timedelta(days=1))
+
+
+# Field projection: "idReadable,customFields(name,value(name))" -> {"idReadable": None, "customFields": {...}}
+
+def parse_fields(fields: str) -> Dict[str, Optional[dict]]:
+    spec = {}
+    for part in split_top_level(fields, ","):
+        if "(" in part:
+            name, rest = part.split("(", 1)
+            spec[name.strip()] = parse_fields(rest[:-1])
+        else:
+            spec[part] = None
+    return spec
+
+
+def project(value, spec: Optional[dict]):
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        if spec is None:
+            return {}
+        return {name: project(value[name], sub_spec) for name, sub_spec in spec.items() if name in value}
+    return value
+
+
+# Stand-in server
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = parse_qs(parts.query)
+        if parts.path.rstrip("/").endswith("/activities"):
+            try:
+                self.send_json(self.server.store.comment_activities(parts.path, params))
+            except KeyError as error:
+                self.send_json({"error": str(error)}, 404)
+            return
+        if not parts.path.endswith("/issues"):
+            self.send_json({"error": "not_found"}, 404)
+            return
+
+        query = first(params, "query", "")
+        fields = first(params, "fields", "idReadable")
+        custom_fields = params.get("customFields", [])
+        skip = int(first(params, "$skip", "0"))
+        top = int(first(params, "$top", "-1"))
+
+        try:
+            issues = self.server.store.find(query, fields, custom_fields)
+        except KeyError as error:
+            self.send_json({"error": str(error)}, 404)
+            return
+
+        page = issues[skip:] if top < 0 else issues[skip:skip + top]
+        spec = parse_fields(fields)
+        response = []
+        for issue in page:
+            if custom_fields:
+                issue = dict(issue, customFields=[field for field in issue.get("customFields", [])
+                                                  if field["name"] in custom_fields])
+            response.append(project(issue, spec))
+        self.send_json(response)
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not parts.path.endswith("/issuesGetter/count"):
+            self.send_json({"error": "not_found"}, 404)
+            return
+        try:
+            self.send_json({"count": self.server.store.count(body.get("query", "")), "$type": "IssueCountResponse"})
+        except KeyError as error:
+            self.send_json({"error": str(error)}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Local HTTP server which answers /api/issues, /api/issues/{id}/activities and /api/issuesGetter/count like YouTrack does.
+class StandInServer:
+    def __init__(self, store, host: str = "127.0.0.1", port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.store = store
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self) -> "StandInServer":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def replay_server(path: str = FIXTURES_FILE) -> StandInServer:
+    return StandInServer(FixtureStore(load_fixtures(path)))
+
+
+def synthetic_server(count: int, seed: int = 0) -> StandInServer:
+    return StandInServer(SyntheticStore(generate_issues(count, seed)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python youtrack_standin.py [fixtures file | number of synthetic issues]
+    source = sys.argv[1] if len(sys.argv) > 1 else FIXTURES_FILE
+    stand_in = synthetic_server(int(source)) if source.isdigit() else replay_server(source)
+    print(f"Serving YouTrack stand-in at {stand_in.url}")
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.server.server_close()